@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 from decouple import AutoConfig
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'debug_toolbar',
     'colorfield',
@@ -50,6 +52,7 @@ INSTALLED_APPS = [
     'orders',
     'products',
     'users',
+    'utils',
 ]
 
 MIDDLEWARE = [
@@ -93,7 +96,7 @@ HAS_DATABASE = config("HAS_DATABASE", cast=bool, default=False)
 if not HAS_DATABASE :
     DATABASES = {
         'default' : {
-            'ENGINE': 'django.db.backend.sqlite3',
+            'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR.joinpath(config("DB_NAME", default="db")+".sqlite3"),  
         } 
     }
@@ -110,6 +113,34 @@ else:
     }
 
 
+# Cache
+# Local memory per process by default, set REDIS_URL to share the response cache between workers
+
+REDIS_URL = config("REDIS_URL", default=None)
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cached responses are invalidated by generation counters in the cache, commands and every worker
+# process must bump and read the same counters, so response caching needs the shared redis cache
+RESPONSE_CACHE = config("RESPONSE_CACHE", cast=bool, default=bool(REDIS_URL))
+if RESPONSE_CACHE and not REDIS_URL:
+    raise ImproperlyConfigured("RESPONSE_CACHE needs a shared cache, set REDIS_URL")
+
+# Safety net only, cached responses are invalidated by generation counters on writes
+RESPONSE_CACHE_TIMEOUT = config("RESPONSE_CACHE_TIMEOUT", cast=int, default=3600)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -154,6 +185,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Seconds product views are counted in process memory before one bulk flush to the database
+VIEW_COUNTER_FLUSH_SECONDS = config("VIEW_COUNTER_FLUSH_SECONDS", cast=int, default=30)
+
+# Payment gateway, called from async views only, run_payment_gateway_stub serves the default URL offline
+PAYMENT_GATEWAY_URL = config("PAYMENT_GATEWAY_URL", default="http://127.0.0.1:8765")
+PAYMENT_GATEWAY_API_KEY = config("PAYMENT_GATEWAY_API_KEY", default="")
+# Seconds per attempt, a request takes at most (retries + 1) attempts plus the jittered backoff
+PAYMENT_GATEWAY_TIMEOUT = config("PAYMENT_GATEWAY_TIMEOUT", cast=float, default=5)
+PAYMENT_GATEWAY_RETRIES = config("PAYMENT_GATEWAY_RETRIES", cast=int, default=2)
+# Consecutive failed requests that open the circuit, and seconds before one trial request is let through
+PAYMENT_GATEWAY_FAILURE_THRESHOLD = config("PAYMENT_GATEWAY_FAILURE_THRESHOLD", cast=int, default=5)
+PAYMENT_GATEWAY_RESET_SECONDS = config("PAYMENT_GATEWAY_RESET_SECONDS", cast=float, default=30)
+
 CONSTANCE_BACKEND = 'constance.backends.database.DatabaseBackend'
 
 CONSTANCE_CONFIG = {
@@ -163,6 +207,13 @@ CONSTANCE_CONFIG = {
     'USER_TOKEN_LENGTH': (32, 'Length of User Token', int),
 
     'USER_WRONG_ATTEMPTS_MAX': (5, 'Number of Wrong Random Number Tries', int),
+
+    'CATEGORY_PRICE_HISTOGRAM_BUCKETS': (10, 'Number of price buckets in category filters', int),
+    'SIMILAR_PRODUCTS_COUNT': (12, 'Number of similar products stored for every product', int),
+
+    'RESERVATION_TTL_MINUTE': (15, 'Number of minutes checkout holds reserved stock before payment', int),
+
+    'IDEMPOTENCY_KEY_TTL_HOUR': (24, 'Number of hours a response is replayed to retries with the same Idempotency-Key', int),
 }
 
 CONSTANCE_CONFIG_FIELDSETS = {
@@ -171,6 +222,18 @@ CONSTANCE_CONFIG_FIELDSETS = {
                    "USER_RANDOM_NUMBER_LENGTH", "USER_WRONG_ATTEMPTS_MAX"),
         "collapse": False
     },
+    "Product Configs": {
+        "fields": ("CATEGORY_PRICE_HISTOGRAM_BUCKETS", "SIMILAR_PRODUCTS_COUNT"),
+        "collapse": False
+    },
+    "Order Configs": {
+        "fields": ("RESERVATION_TTL_MINUTE",),
+        "collapse": False
+    },
+    "API Configs": {
+        "fields": ("IDEMPOTENCY_KEY_TTL_HOUR",),
+        "collapse": False
+    },
 }
 
 
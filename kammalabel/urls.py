@@ -23,5 +23,6 @@ urlpatterns = [
     path('v1/product/', include('products.urls')),
     path('v1/order/', include('orders.urls')),
     path('v1/users/', include('users.urls')),
+    path('v1/', include('utils.urls')),
     path('__debug__/', include('debug_toolbar.urls')),
 ]
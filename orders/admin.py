@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Order, OrderItem
+from .models import Order, OrderItem, Reservation
 
 from utils.default_string import S
 
@@ -41,4 +41,16 @@ class OrderItemAdmin (admin.ModelAdmin):
             ),
         }),
     )
-    
\ No newline at end of file
+    
+
+
+@admin.register(Reservation)
+class ReservationAdmin (admin.ModelAdmin):
+    """
+        Stock Reservation Admin Model
+    """
+
+    list_display = [S.ORDER, S.PRODUCT_INSTANCE, S.COUNT, S.RESERVATION_STATUS, S.EXPIRE_DT]
+    list_filter = [S.RESERVATION_STATUS]
+    raw_id_fields = [S.ORDER, S.PRODUCT_INSTANCE]
+    readonly_fields = [S.ORDER, S.PRODUCT_INSTANCE, S.COUNT, S.RESERVATION_STATUS]
@@ -0,0 +1,215 @@
+"""
+    Asynchronous payment gateway client.
+    Every process keeps one long lived client on an event loop of its own thread, views of any loop
+    hand their calls to it: under WSGI asgiref runs each async view on a fresh loop, a connection pool
+    bound to that loop could not serve the next request. So keep-alive connections are reused across
+    requests and retries. Every attempt has a strict timeout, failed attempts are retried a bounded
+    number of times with full jitter backoff, and a process wide circuit breaker fails fast while the
+    gateway keeps failing, so a slow gateway holds a worker for at most the bounded retry time.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, status
+
+from utils.default_string import S
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_SECONDS = 0.2
+
+PENDING = "pending"
+PAID = "paid"
+FAILED = "failed"
+
+
+class GatewayError(exceptions.APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = _("Payment gateway failed, try again later")
+    default_code = "gateway_error"
+
+
+class GatewayUnavailable(GatewayError):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _("Payment gateway is unavailable, try again later")
+    default_code = "gateway_unavailable"
+
+
+class CircuitBreaker:
+    """
+        Closed until failure_threshold consecutive failures, then open for reset_seconds,
+        then half open: a single trial request decides between closed and open again.
+        Shared by the threads of a process, every state change holds the lock.
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_seconds:
+                raise GatewayUnavailable()
+            self.trial = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                logger.warning(f"payment gateway circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+    def cancelled(self):
+        """
+            A trial request cancelled by a client disconnect must not keep the circuit open forever
+        """
+        with self.lock:
+            self.trial = False
+
+
+class GatewayClient:
+
+    def __init__(self, base_url, api_key="", timeout=5, retries=2, breaker=None, transport=None):
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker(settings.PAYMENT_GATEWAY_FAILURE_THRESHOLD,
+                                                 settings.PAYMENT_GATEWAY_RESET_SECONDS)
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.http = httpx.AsyncClient(
+            base_url=base_url, headers=headers, transport=transport,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 2)),
+        )
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def request(self, method, url, **kwargs):
+        """
+            JSON body of the response. 4xx answers are final, timeouts, connection errors and 5xx are
+            retried, POSTs are only safe to retry because they carry an Idempotency-Key.
+        """
+        self.breaker.before_request()
+        try:
+            response = await self.attempts(method, url, **kwargs)
+        except asyncio.CancelledError:
+            self.breaker.cancelled()
+            raise
+        if response is None:
+            self.breaker.failure()
+            raise GatewayError()
+        self.breaker.success()
+        if response.is_error:
+            # the answer of the gateway is not for our clients
+            logger.warning(f"payment gateway {method} {url} refused with {response.status_code}: {response.text}")
+            raise GatewayError()
+        return response.json()
+
+    async def attempts(self, method, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, BACKOFF_SECONDS * 2 ** attempt))
+            try:
+                response = await self.http.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                logger.warning(f"payment gateway {method} {url} attempt {attempt + 1}: {e!r}")
+                continue
+            if response.status_code < 500:
+                return response
+            logger.warning(f"payment gateway {method} {url} attempt {attempt + 1}: {response.status_code}")
+        return None
+
+    async def create(self, payment, callback_url):
+        """
+            Register the payment, returns {reference, url} where the user pays
+        """
+        return await self.request(
+            "POST", "/payments",
+            json={S.PAYMENT: payment.pk, S.TOTAL_AMOUNT: payment.order.total_amount, "callback_url": callback_url},
+            headers={"Idempotency-Key": f"{S.PAYMENT}-{payment.pk}"},
+        )
+
+    async def verify(self, reference):
+        """
+            One of PAID, FAILED or PENDING
+        """
+        return (await self.request("GET", f"/payments/{reference}"))[S.STATUS]
+
+
+class SharedClient:
+    """
+        The process client and the loop thread it runs on, both started on first use by each process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.breaker = None
+        self.client = None
+        self.loop = None
+        self.options = None
+        self.pid = None
+
+    def get_client(self):
+        options = (settings.PAYMENT_GATEWAY_URL, settings.PAYMENT_GATEWAY_API_KEY,
+                   settings.PAYMENT_GATEWAY_TIMEOUT, settings.PAYMENT_GATEWAY_RETRIES)
+        with self.lock:
+            # forked workers do not inherit the thread of their parent
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="payment-gateway", daemon=True).start()
+                self.breaker = CircuitBreaker(settings.PAYMENT_GATEWAY_FAILURE_THRESHOLD,
+                                              settings.PAYMENT_GATEWAY_RESET_SECONDS)
+                self.client = None
+            if self.options != options:
+                if self.client is not None:
+                    asyncio.run_coroutine_threadsafe(self.client.close(), self.loop)
+                self.client = GatewayClient(*options, breaker=self.breaker)
+                self.options = options
+            return self.client
+
+    async def call(self, name, *args):
+        """
+            Run the client method on the client loop, a cancelled view cancels the call with it
+        """
+        client = self.get_client()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(getattr(client, name)(*args), self.loop))
+
+    async def create(self, payment, callback_url):
+        return await self.call("create", payment, callback_url)
+
+    async def verify(self, reference):
+        return await self.call("verify", reference)
+
+
+client = SharedClient()
@@ -0,0 +1,99 @@
+"""
+    Local stand-in for the payment gateway, so checkout can be run and tested offline.
+    Speaks just enough HTTP/1.1 with keep-alive for the gateway client:
+        POST /payments                      register a payment, same Idempotency-Key same reference
+        GET  /payments/<reference>          {reference, status}
+        POST /payments/<reference>/<status> the user paid (paid) or gave up (failed)
+    delay slows every answer down, failures answers the next requests with 503.
+"""
+
+import asyncio
+import json
+import uuid
+
+from utils.default_string import S
+
+from .gateway import FAILED, PAID, PENDING
+
+
+class StubGateway:
+
+    def __init__(self, host="127.0.0.1", port=8765, delay=0.0, failures=0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.failures = failures
+        self.requests = 0
+        self.connections = 0
+        self.payments = {}
+        self.keys = {}
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, path, _ = line.decode().split(" ", 2)
+                headers = {}
+                while (header := await reader.readline()).strip():
+                    name, value = header.decode().split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                code, payload = await self.answer(method, path, headers, json.loads(body) if body else {})
+                data = json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {code} Stub\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, method, path, headers, body):
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            return 503, {"detail": "unavailable"}
+        parts = path.strip("/").split("/")
+        if method == "POST" and parts == ["payments"]:
+            key = headers.get("idempotency-key") or uuid.uuid4().hex
+            if key not in self.keys:
+                self.keys[key] = uuid.uuid4().hex
+                self.payments[self.keys[key]] = PENDING
+            reference = self.keys[key]
+            return 200, {S.REFERENCE: reference, S.URL: f"{self.url}/payments/{reference}"}
+        if len(parts) >= 2 and parts[0] == "payments" and parts[1] in self.payments:
+            if method == "POST" and len(parts) == 3 and parts[2] in (PAID, FAILED):
+                self.payments[parts[1]] = parts[2]
+            return 200, {S.REFERENCE: parts[1], S.STATUS: self.payments[parts[1]]}
+        return 404, {"detail": "not found"}
+
+
+async def serve_forever(**kwargs):
+    stub = await StubGateway(**kwargs).start()
+    async with stub.server:
+        await stub.server.serve_forever()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = "Return the stock of expired checkout reservations, run it every few minutes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = release_expired(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"released {count} reservations"))
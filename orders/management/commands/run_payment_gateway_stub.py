@@ -0,0 +1,23 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from orders.gateway_stub import serve_forever
+
+
+class Command(BaseCommand):
+    help = "Serve a local payment gateway stub at PAYMENT_GATEWAY_URL for offline development and tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--delay", type=float, default=0.0, help="seconds before every answer")
+        parser.add_argument("--failures", type=int, default=0, help="answer the first requests with 503")
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS(f"payment gateway stub on http://{options['host']}:{options['port']}"))
+        try:
+            asyncio.run(serve_forever(host=options["host"], port=options["port"], delay=options["delay"],
+                                      failures=options["failures"]))
+        except KeyboardInterrupt:
+            pass
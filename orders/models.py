@@ -1,10 +1,13 @@
-from django.db import models
-from django.utils import timezone
+from django.db import models, transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django_autoutils.model_utils import AbstractModel
 from django.utils.translation import gettext_lazy as _
 
 from utils.default_string import S, D
 
+from .numbers import next_order_number
+
 from products.models import ProductInstance
 from users.models import User, Address
 
@@ -31,21 +34,64 @@ class Order (AbstractModel):
         return f"Order {self.number}: {self.user}"
     
     def total_amount_calculate(self, *args, **kwargs):
-        total = sum(item.total_amount for item in self.items.all())
-        self.total_amount = total
-        self.save(update_fields=["total_amount"])
+        self.total_amount = self.items.aggregate(total=Coalesce(Sum(S.TOTAL_AMOUNT), 0))["total"]
+        self.save(update_fields=[S.TOTAL_AMOUNT])
+
+    @classmethod
+    def create_from_cart(cls, cart, **kwargs):
+        """
+            Order with one item per Cart/SessionCart item, prices read in one query and the total
+            computed once, a fixed number of queries whatever the cart size
+        """
+        lines = cart.items.values_list(S.PRODUCT_INSTANCE, S.COUNT, f"{S.PRODUCT_INSTANCE}__{S.PRODUCT}__{S.PRICE}")
+        return cls.create_from_lines(lines, **kwargs)
+
+    @classmethod
+    def create_from_lines(cls, lines, **kwargs):
+        """
+            Order from [(instance id, count, unit price)], the prices are stored on the items as they are now
+        """
+        lines = list(lines)
+        with transaction.atomic():
+            order = cls.objects.create(total_amount=sum(count * price for _, count, price in lines), **kwargs)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, count=count, total_amount=count * price)
+                for product_id, count, price in lines
+            ])
+        return order
 
     def save(self, *args, **kwargs):
-        if self.pk is None:
-            self.number = f"ORD-{timezone.now().strftime("%Y%m%d")}-{len(Order.objects.all())+1:08d}"
-            super().save(*args, **kwargs)
-        else:
-            super().save(*args, **kwargs)
+        if self.pk is None and not self.number:
+            self.number = next_order_number()
+        super().save(*args, **kwargs)
 
     class Meta:
         db_table = D.ORDER
         verbose_name = _("order")
         verbose_name_plural = _("orders")
+        indexes = [
+            models.Index(name=f"{D.ORDER}_user_insert_dt_id_idx", fields=[S.USER, S.INSERT_DT, S.ID]),
+            models.Index(name=f"{D.ORDER}_update_dt_idx", fields=[S.UPDATE_DT]),
+        ]
+        constraints = [
+            models.UniqueConstraint(name=f"{D.ORDER}_number_unique", fields=[S.NUMBER]),
+        ]
+
+
+class OrderNumberCounter (AbstractModel):
+    """
+        Order number counter for databases without sequences
+    """
+    name = models.CharField(_("name"), max_length=50, unique=True)
+    value = models.PositiveBigIntegerField(_("value"), default=0)
+
+    def __str__(self):
+        return f"{self.name}:{self.value}"
+
+    class Meta:
+        db_table = D.ORDER_NUMBER_COUNTER
+        verbose_name = _("order_number_counter")
+        verbose_name_plural = _("order_number_counters")
 
 
 class OrderItem(AbstractModel):
@@ -66,6 +112,39 @@ class OrderItem(AbstractModel):
         db_table = D.ORDER_ITEM
         verbose_name = _("order_item")
         verbose_name_plural = _("order_items")
+        indexes = [
+            models.Index(name=f"{D.ORDER_ITEM}_update_dt_idx", fields=[S.UPDATE_DT]),
+        ]
+
+
+class Reservation (AbstractModel):
+    """
+        Stock of one product instance held for an order until it is paid or expires
+    """
+    class ReservationStatus(models.IntegerChoices):
+        ACTIVE = 1, _("Active")
+        RELEASED = 2, _("Released")
+        CONSUMED = 3, _("Consumed")
+
+    order = models.ForeignKey(Order, verbose_name=_("order"), on_delete=models.CASCADE, related_name="reservations")
+    product_instance = models.ForeignKey(ProductInstance, verbose_name=_("product_instance"), on_delete=models.PROTECT,
+                                         related_name="reservations")
+    count = models.PositiveIntegerField(_("count"))
+    reservation_status = models.IntegerField(choices=ReservationStatus.choices, default=ReservationStatus.ACTIVE)
+    expire_dt = models.DateTimeField(_("expire_dt"))
+
+    def __str__(self):
+        return f"{self.order_id}:{self.product_instance_id}:{self.count}"
+
+    class Meta:
+        db_table = D.RESERVATION
+        verbose_name = _("reservation")
+        verbose_name_plural = _("reservations")
+        indexes = [
+            models.Index(name=f"{D.RESERVATION}_active_expire_idx", fields=[S.EXPIRE_DT],
+                         condition=models.Q(reservation_status=1)),
+            models.Index(name=f"{D.RESERVATION}_order_status_idx", fields=[S.ORDER, S.RESERVATION_STATUS]),
+        ]
 
 
 class Payment(AbstractModel):
@@ -80,6 +159,7 @@ class Payment(AbstractModel):
     user = models.ForeignKey(User, verbose_name=_("user"), null=True, on_delete=models.SET_NULL, related_name='payments') 
     order = models.OneToOneField(Order, verbose_name=_("order"), on_delete=models.PROTECT, related_name='payment')
     payment_status = models.IntegerField(choices=PaymentStatus.choices, default=PaymentStatus.NEW)
+    reference = models.CharField(_("reference"), max_length=64, null=True, blank=True, unique=True)
 
     def __str__(self):
         return f'{self.user}:{self.order}'
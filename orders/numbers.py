@@ -0,0 +1,122 @@
+"""
+    Order numbers from a database sequence, O(1) and unique under concurrent checkouts
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from utils.default_string import D, S
+
+
+class PostgresOrderNumbers:
+    """
+        Native sequence, nextval never waits on other transactions and is never rolled back
+    """
+    SEQUENCE = f"{D.ORDER}_number_seq"
+
+    def install(self):
+        """
+            Start after the existing orders so numbers of the old count based scheme are not reused
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s), to_regclass(%s)", [self.SEQUENCE, D.ORDER])
+            sequence, table = cursor.fetchone()
+            if sequence is not None:
+                return
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {self.SEQUENCE}")
+            if table is not None:
+                cursor.execute(f'SELECT setval(%s, (SELECT COUNT(*) FROM "{D.ORDER}") + 1, false)', [self.SEQUENCE])
+
+    def next(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [self.SEQUENCE])
+            return cursor.fetchone()[0]
+
+
+class CounterOrderNumbers:
+    """
+        Counter row for databases without sequences. Blocks of numbers are reserved in short transactions on
+        the connection of a dedicated thread, the row is never locked for the length of a checkout and a rolled
+        back checkout only leaves a gap, like a sequence. SQLite serializes writers anyway and a second connection
+        would wait on the write lock of the caller, there numbers are reserved one by one in the caller transaction.
+    """
+    NAME = D.ORDER
+    BLOCK = 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+        self.numbers = iter(())
+
+    def install(self):
+        pass
+
+    def reserve(self, size):
+        """
+            Advance the counter by size and return the numbers it moved over
+        """
+        from .models import Order, OrderNumberCounter
+
+        with transaction.atomic():
+            counters = OrderNumberCounter.objects.filter(name=self.NAME)
+            if not counters.update(value=F(S.VALUE) + size):
+                try:
+                    with transaction.atomic():
+                        # one time count, starts after the numbers of the old count based scheme
+                        OrderNumberCounter.objects.create(name=self.NAME, value=Order.objects.count() + size)
+                except IntegrityError:
+                    counters.update(value=F(S.VALUE) + size)
+            value = counters.values_list(S.VALUE, flat=True).get()
+        return range(value - size + 1, value + 1)
+
+    def reserve_block(self):
+        connection.close_if_unusable_or_obsolete()
+        return self.reserve(self.BLOCK)
+
+    def next(self):
+        if connection.vendor == "sqlite":
+            return self.reserve(1)[0]
+        with self.lock:
+            if self.pid != os.getpid():
+                # forked workers neither inherit the thread nor may share the block of their parent
+                self.pid, self.executor, self.numbers = os.getpid(), ThreadPoolExecutor(max_workers=1), iter(())
+            number = next(self.numbers, None)
+            if number is None:
+                self.numbers = iter(self.executor.submit(self.reserve_block).result())
+                number = next(self.numbers)
+            return number
+
+    def close(self):
+        """
+            Close the connection of the reserving thread and drop the rest of the block
+        """
+        with self.lock:
+            if self.executor is not None and self.pid == os.getpid():
+                # the connection proxy must be resolved inside the reserving thread
+                self.executor.submit(lambda: connection.close()).result()
+                self.executor.shutdown()
+            self.pid, self.executor, self.numbers = None, None, iter(())
+
+
+counter = CounterOrderNumbers()
+
+BACKENDS = {
+    "postgresql": PostgresOrderNumbers(),
+}
+
+
+def get_order_numbers():
+    return BACKENDS.get(connection.vendor, counter)
+
+
+def next_order_number():
+    """
+        ORD-<day>-<sequence>, the day is a readable prefix, the sequence alone is unique
+    """
+    return f"ORD-{timezone.now().strftime('%Y%m%d')}-{get_order_numbers().next():08d}"
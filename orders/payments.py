@@ -0,0 +1,42 @@
+"""
+    Payment results verified with the gateway, applied to the payment, its order and its reservations
+"""
+
+import logging
+
+from django.db import transaction
+
+from utils.default_string import S
+
+from . import gateway, reservations
+from .models import Order, Payment
+
+logger = logging.getLogger(__name__)
+
+
+def settle(payment_id, gateway_status):
+    """
+        Apply a verified gateway status once, repeated or concurrent callbacks of a settled payment
+        change nothing. A paid order whose reservations lapsed and were sold meanwhile fails and
+        is logged for a refund.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related(S.ORDER).get(pk=payment_id)
+        if payment.payment_status != Payment.PaymentStatus.NEW or gateway_status == gateway.PENDING:
+            return payment
+        order = payment.order
+        if gateway_status == gateway.PAID:
+            payment.payment_status = Payment.PaymentStatus.SUCCESSFUL
+            try:
+                reservations.consume(order)
+                order.order_status = Order.OrderStatus.PAID
+            except reservations.OutOfStock:
+                logger.error(f"order {order.number} was paid after its stock was sold, refund payment {payment.pk}")
+                order.order_status = Order.OrderStatus.FAILED
+        else:
+            payment.payment_status = Payment.PaymentStatus.FAILED
+            reservations.release(order)
+            order.order_status = Order.OrderStatus.FAILED
+        payment.save(update_fields=[S.PAYMENT_STATUS, S.UPDATE_DT])
+        order.save(update_fields=[S.ORDER_STATUS, S.UPDATE_DT])
+    return payment
@@ -0,0 +1,127 @@
+"""
+    Stock reservations for checkout.
+    Reserving is one conditional UPDATE ... WHERE stock >= count over all instances of the order,
+    so parallel checkouts never oversell. Rows of several instances are locked in id order first,
+    two carts with the same items queue behind each other instead of deadlocking. Expired
+    reservations are returned in bulk, payment turns the active ones into permanent decrements.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, status
+
+from products import stock
+from products.models import ProductInstance
+
+from utils.default_string import S
+from utils.server_utils import reservation_expire_dt_generator
+
+from .models import Reservation
+
+
+class OutOfStock(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _("Not enough stock for this order")
+    default_code = "out_of_stock"
+
+
+def lock(counts):
+    if len(counts) > 1:
+        ProductInstance.objects.filter(pk__in=counts).lock_in_order()
+
+
+def take(counts):
+    """
+        Decrement every {instance id: count} or none of them
+    """
+    with transaction.atomic():
+        lock(counts)
+        if ProductInstance.objects.take_stock(counts) != len(counts):
+            raise OutOfStock()
+        stock.moved({pk: -count for pk, count in counts.items()})
+
+
+def put_back(counts):
+    if not counts:
+        return
+    lock(counts)
+    ProductInstance.objects.return_stock(counts)
+    stock.moved(counts)
+
+
+def reserve(order, items):
+    """
+        Hold stock of [(instance id, count)] for the order, all or nothing
+    """
+    counts = Counter()
+    for pk, count in items:
+        counts[pk] += count
+    expire_dt = reservation_expire_dt_generator()
+    with transaction.atomic():
+        take(counts)
+        return Reservation.objects.bulk_create([
+            Reservation(order=order, product_instance_id=pk, count=count, expire_dt=expire_dt)
+            for pk, count in sorted(counts.items())
+        ])
+
+
+def release_rows(reservations):
+    """
+        Mark locked active reservations released and return their stock
+    """
+    counts = Counter()
+    for reservation in reservations:
+        counts[reservation.product_instance_id] += reservation.count
+    Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(
+        reservation_status=Reservation.ReservationStatus.RELEASED, update_dt=timezone.now())
+    put_back(counts)
+    return len(reservations)
+
+
+def release(order):
+    """
+        Give back the stock of a cancelled or failed order
+    """
+    with transaction.atomic():
+        reservations = list(order.reservations.select_for_update().filter(
+            reservation_status=Reservation.ReservationStatus.ACTIVE))
+        return release_rows(reservations)
+
+
+def release_expired(batch_size=500, now=None):
+    """
+        Release expired reservations batch by batch, locked rows are skipped so several workers can run
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            reservations = list(Reservation.objects.select_for_update(skip_locked=True).filter(
+                reservation_status=Reservation.ReservationStatus.ACTIVE, expire_dt__lte=now,
+            ).order_by(S.EXPIRE_DT)[:batch_size])
+            if not reservations:
+                return released
+            released += release_rows(reservations)
+
+
+def consume(order):
+    """
+        Make the order reservations permanent on payment. Reservations that expired meanwhile are
+        taken again, OutOfStock when that stock was sold to someone else.
+    """
+    with transaction.atomic():
+        reservations = list(order.reservations.select_for_update().exclude(
+            reservation_status=Reservation.ReservationStatus.CONSUMED))
+        lapsed = Counter()
+        for reservation in reservations:
+            if reservation.reservation_status == Reservation.ReservationStatus.RELEASED:
+                lapsed[reservation.product_instance_id] += reservation.count
+        if lapsed:
+            take(lapsed)
+        Reservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(
+            reservation_status=Reservation.ReservationStatus.CONSUMED, update_dt=timezone.now())
+        return len(reservations)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from .checkout import Checkout
 from .models import Order, OrderItem, Payment
 
 from products.models import ProductInstance
@@ -125,27 +126,11 @@ class UserPayments (serializers.ModelSerializer):
 
 
 class StartPaymentSerializer (BaseSerializer):
-
-    @staticmethod
-    def create_order(user, shipping_address):
-        order = Order.objects.create(
-            user=user,
-            shipping_address=shipping_address
-        )
-        return order
-    
-    @staticmethod
-    def create_payment(order, user):
-        payment = Payment.objects.create(
-            order=order,
-            user=user
-        )
-        return payment
-    
+    """
+        Checkout the cart of the user, the stage timings are left in the context for the view
+    """
 
     def create(self, validated_data):
-        user = self.context['request'].user
-        address = user.addresses.last()
-        order = self.create_order(user=user, shipping_address=address)
-        payment = self.create_payment(order=order, user=user)
-        return payment
\ No newline at end of file
+        checkout = Checkout(self.context['request'].user)
+        self.context[S.TIMINGS] = checkout.timer
+        return checkout.run()
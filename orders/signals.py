@@ -0,0 +1,13 @@
+from django.db.models.signals import pre_migrate
+from django.dispatch import receiver
+
+from .numbers import get_order_numbers
+
+
+@receiver(pre_migrate)
+def install_order_numbers(sender, **kwargs):
+    """
+        The order number sequence must exist before the first order is created
+    """
+    if sender.name == "orders":
+        get_order_numbers().install()
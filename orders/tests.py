@@ -1,3 +1,353 @@
-from django.test import TestCase
+import base64
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import gateway
+from .checkout import Checkout
+from .gateway_stub import StubGateway
+from .models import Order, Payment, Reservation
+from .numbers import CounterOrderNumbers
+from .reservations import OutOfStock, consume, release_expired, reserve
+
+from products.models import Category, Color, Material, Product, ProductInstance, Size
+from users.models import Address, Cart, CartItem, User
+
+from utils.default_string import S, U
+from utils.idempotency import delete_expired
+from utils.models import IdempotencyKey
+
+
+def create_address():
+    user = User.objects.create(username="buyer", email="buyer@example.com", phone_number="+14155550100",
+                               first_name="buyer", last_name="buyer")
+    return Address.objects.create(user=user, title="home", post_code="1", state="state", city="city",
+                                  latitude=0, longitude=0, postal_address="address")
+
+
+class OrderNumberTestCase (TransactionTestCase):
+    """
+        Orders created in parallel must never share a number
+    """
+    ORDERS = 200
+    WORKERS = 16
+
+    def create_order(self, address):
+        try:
+            return Order.objects.create(user=address.user, shipping_address=address).number
+        finally:
+            connection.close()
+
+    @skipUnlessDBFeature("test_db_allows_multiple_connections")
+    def test_parallel_orders_get_unique_numbers(self):
+        address = create_address()
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            numbers = list(executor.map(self.create_order, [address] * self.ORDERS))
+        self.assertEqual(len(set(numbers)), self.ORDERS)
+        self.assertEqual(Order.objects.values(S.NUMBER).distinct().count(), self.ORDERS)
+
+    def test_order_number_query_count_is_constant(self):
+        address = create_address()
+        Order.objects.create(user=address.user, shipping_address=address)
+        with CaptureQueriesContext(connection) as first:
+            Order.objects.create(user=address.user, shipping_address=address)
+        Order.objects.bulk_create([Order(user=address.user, shipping_address=address, number=f"old-{index}")
+                                   for index in range(500)])
+        with CaptureQueriesContext(connection) as later:
+            Order.objects.create(user=address.user, shipping_address=address)
+        self.assertEqual(len(first.captured_queries), len(later.captured_queries))
+
+    @skipUnlessDBFeature("test_db_allows_multiple_connections")
+    def test_counter_is_not_locked_by_an_open_checkout(self):
+        if connection.vendor == "sqlite":
+            self.skipTest("SQLite reserves numbers in the caller transaction")
+        checkout, other = CounterOrderNumbers(), CounterOrderNumbers()
+        self.addCleanup(checkout.close)
+        self.addCleanup(other.close)
+        with transaction.atomic():
+            first = checkout.next()
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                second = executor.submit(other.next).result(timeout=10)
+        self.assertEqual(second, first + CounterOrderNumbers.BLOCK)
+        self.assertEqual(checkout.next(), first + 1)
+
+
+class OrderHistoryTestCase (TestCase):
+    """
+        Keyset pages must not skip orders created within the same millisecond
+    """
+
+    def test_pages_keep_microseconds(self):
+        address = create_address()
+        orders = [Order.objects.create(user=address.user, shipping_address=address) for _ in range(4)]
+        now = timezone.now().replace(microsecond=123000)
+        for index, order in enumerate(orders):
+            Order.objects.filter(pk=order.pk).update(insert_dt=now + timezone.timedelta(microseconds=100 * index))
+        client = APIClient()
+        client.force_authenticate(address.user)
+        numbers, url = [], reverse(f"{U.V1_ORDER}-list") + "?page_size=1"
+        while url:
+            response = client.get(url)
+            numbers.extend(row[S.NUMBER] for row in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(numbers, [order.number for order in reversed(orders)])
+
+class CartOrderTestCase (TestCase):
+    """
+        An order built from a cart costs the same queries for 2 or 40 items
+    """
+
+    def setUp(self):
+        self.address = create_address()
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.product = Product.objects.create(name="product", category=category, price=10,
+                                              material=Material.objects.create(name="material"))
+        self.color = Color.objects.create(name="color")
+        self.size = Size.objects.create(name="size")
+        # the first order number creates the counter row where there is no sequence
+        Order.objects.create(user=self.address.user, shipping_address=self.address)
+
+    def create_cart(self, size):
+        cart = Cart.objects.create(user=self.address.user, total_amount=0)
+        for index in range(size):
+            instance = ProductInstance.objects.create(product=self.product, stock=5, color=self.color, size=self.size,
+                                                      p_id=f"{cart.pk}-{index}")
+            CartItem.objects.create(cart=cart, product_instance=instance, count=2)
+        return cart
+
+    def create_order(self, cart):
+        with CaptureQueriesContext(connection) as context:
+            order = Order.create_from_cart(cart, user=self.address.user, shipping_address=self.address)
+        return order, len(context.captured_queries)
+
+    def test_order_from_cart(self):
+        small, small_queries = self.create_order(self.create_cart(2))
+        large, large_queries = self.create_order(self.create_cart(40))
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large.items.count(), 40)
+        self.assertEqual(large.total_amount, 40 * 2 * 10)
+
+
+class CheckoutTestCase (CartOrderTestCase):
+    """
+        Checkout costs the same queries for 2 or 40 items and leaves nothing behind when stock runs out
+    """
+
+    def checkout(self, cart):
+        with CaptureQueriesContext(connection) as context:
+            payment = Checkout(self.address.user).run()
+        return payment, len(context.captured_queries)
+
+    def test_checkout(self):
+        # settings and counters read for the first time are not part of the comparison
+        self.checkout(self.create_cart(1))
+        _, small_queries = self.checkout(self.create_cart(2))
+        payment, large_queries = self.checkout(self.create_cart(40))
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(payment.order.items.count(), 40)
+        self.assertEqual(payment.order.reservations.count(), 40)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.address.user).exists())
+        self.assertEqual(ProductInstance.objects.filter(stock=3).count(), 43)
+        self.assertEqual(Product.objects.get().stock, 43 * 3)
+
+    def test_out_of_stock_rolls_back(self):
+        cart = self.create_cart(3)
+        cart.items.update(count=6)
+        with self.assertRaises(OutOfStock):
+            Checkout(self.address.user).run()
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(cart.items.count(), 3)
+        self.assertEqual(ProductInstance.objects.filter(stock=5).count(), 3)
+
+
+class IdempotentCheckoutTestCase (CartOrderTestCase):
+    """
+        A retried checkout with the same Idempotency-Key replays the first response and pays once
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.address.user)
+
+    def checkout(self, key, data=None):
+        return self.client.post(reverse(f"{U.V1_PAYMENT}-create-payment"), data or {}, format="json",
+                                headers={"Idempotency-Key": key})
+
+    def test_retry_is_replayed(self):
+        self.create_cart(2)
+        first = self.checkout("first")
+        retry = self.checkout("first")
+        self.assertEqual(first.status_code, retry.status_code)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(self.checkout("second").status_code, 400)
+        self.assertEqual(self.checkout("first", {S.COUNT: 1}).status_code, 422)
+
+    def test_expired_keys_are_deleted(self):
+        self.create_cart(2)
+        self.checkout("first")
+        self.assertEqual(delete_expired(now=timezone.now() + timezone.timedelta(days=2)), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@skipUnlessDBFeature("test_db_allows_multiple_connections", "has_select_for_update_skip_locked")
+class ReservationStressTestCase (TransactionTestCase):
+    """
+        Parallel checkouts of one SKU must sell exactly its stock, no more and no less
+    """
+    STOCK = 25
+    CHECKOUTS = 100
+    WORKERS = 16
+
+    def setUp(self):
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        product = Product.objects.create(name="product", category=category, price=10,
+                                         material=Material.objects.create(name="material"))
+        self.instance = ProductInstance.objects.create(product=product, stock=self.STOCK, p_id="sku",
+                                                       color=Color.objects.create(name="color"),
+                                                       size=Size.objects.create(name="size"))
+        address = create_address()
+        self.orders = [Order.objects.create(user=address.user, shipping_address=address)
+                       for _ in range(self.CHECKOUTS)]
+
+    def checkout(self, order):
+        try:
+            reserve(order, [(self.instance.pk, 1)])
+            return True
+        except OutOfStock:
+            return False
+        finally:
+            connection.close()
+
+    def run_checkouts(self):
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return sum(executor.map(self.checkout, self.orders))
+
+    def test_parallel_checkouts_never_oversell(self):
+        self.assertEqual(self.run_checkouts(), self.STOCK)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.stock, 0)
+        self.assertEqual(Product.objects.get().stock, 0)
+        self.assertEqual(Reservation.objects.filter(
+            reservation_status=Reservation.ReservationStatus.ACTIVE).count(), self.STOCK)
+
+    def test_expired_reservations_are_released(self):
+        self.run_checkouts()
+        released = release_expired(now=timezone.now() + timezone.timedelta(days=1))
+        self.assertEqual(released, self.STOCK)
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.stock, self.STOCK)
+
+    def test_payment_consumes_reservation(self):
+        self.run_checkouts()
+        order = Reservation.objects.first().order
+        self.assertEqual(consume(order), 1)
+        release_expired(now=timezone.now() + timezone.timedelta(days=1))
+        self.instance.refresh_from_db()
+        self.assertEqual(self.instance.stock, self.STOCK - 1)
+
+
+class GatewayClientTestCase (SimpleTestCase):
+    """
+        Retries, timeouts and the circuit breaker against the local stub
+    """
+
+    def client_for(self, stub, retries=2, timeout=1.0):
+        breaker = gateway.CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        return gateway.GatewayClient(stub.url, timeout=timeout, retries=retries, breaker=breaker)
+
+    async def test_retries_server_errors(self):
+        async with StubGateway(port=0, failures=2) as stub, self.client_for(stub) as client:
+            headers = {"Idempotency-Key": "key"}
+            reference = (await client.request("POST", "/payments", headers=headers))[S.REFERENCE]
+            again = (await client.request("POST", "/payments", headers=headers))[S.REFERENCE]
+            self.assertEqual(reference, again)
+            self.assertEqual(await client.verify(reference), gateway.PENDING)
+        self.assertEqual(stub.requests, 5)
+
+    async def test_timeouts_open_the_circuit(self):
+        async with StubGateway(port=0, delay=0.5) as stub, self.client_for(stub, retries=0, timeout=0.05) as client:
+            for _ in range(2):
+                with self.assertRaises(gateway.GatewayError):
+                    await client.verify("missing")
+            self.assertTrue(client.breaker.is_open)
+            with self.assertRaises(gateway.GatewayUnavailable):
+                await client.verify("missing")
+        self.assertEqual(stub.requests, 2)
+
+    async def test_refusal_is_not_forwarded(self):
+        async with StubGateway(port=0) as stub, self.client_for(stub) as client:
+            with self.assertRaises(gateway.GatewayError) as context:
+                await client.verify("missing")
+        self.assertEqual(context.exception.detail, gateway.GatewayError.default_detail)
+
+    def test_single_half_open_trial(self):
+        breaker = gateway.CircuitBreaker(failure_threshold=1, reset_seconds=0)
+        breaker.failure()
+
+        def trial(_):
+            try:
+                breaker.before_request()
+                return True
+            except gateway.GatewayUnavailable:
+                return False
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertEqual(sum(executor.map(trial, range(32))), 1)
+
+    async def test_shared_client_reuses_connections(self):
+        async with StubGateway(port=0) as stub:
+            with override_settings(PAYMENT_GATEWAY_URL=stub.url):
+                for _ in range(3):
+                    await gateway.client.call("request", "POST", "/payments")
+        self.assertEqual(stub.requests, 3)
+        self.assertEqual(stub.connections, 1)
+
+
+@override_settings(PAYMENT_GATEWAY_RETRIES=0)
+class PaymentCallbackTestCase (CartOrderTestCase):
+    """
+        The callback settles a payment once, with the status the gateway reports
+    """
+
+    def create_payment(self):
+        self.create_cart(2)
+        return Checkout(self.address.user).run()
+
+    async def pay(self, status):
+        payment = await sync_to_async(self.create_payment)()
+        await sync_to_async(self.address.user.set_password)("password")
+        await self.address.user.asave()
+        credentials = base64.b64encode(f"{self.address.user.username}:password".encode()).decode()
+        async with StubGateway(port=0) as stub:
+            with override_settings(PAYMENT_GATEWAY_URL=stub.url):
+                url = reverse(U.V1_PAYMENT_START, args=[payment.pk])
+                self.assertEqual((await self.async_client.post(url)).status_code, 401)
+                response = await self.async_client.post(url, headers={"Authorization": f"Basic {credentials}"})
+                reference = response.json()[S.REFERENCE]
+                stub.payments[reference] = status
+                response = await self.async_client.get(reverse(U.V1_PAYMENT_CALLBACK), {S.REFERENCE: reference})
+        await payment.arefresh_from_db()
+        return payment, response.json()
+
+    async def test_paid(self):
+        payment, answer = await self.pay(gateway.PAID)
+        self.assertEqual(payment.payment_status, Payment.PaymentStatus.SUCCESSFUL)
+        self.assertEqual(answer[S.PAYMENT_STATUS], Payment.PaymentStatus.SUCCESSFUL)
+        order = await Order.objects.aget(pk=payment.order_id)
+        self.assertEqual(order.order_status, Order.OrderStatus.PAID)
+        self.assertFalse(await order.reservations.exclude(
+            reservation_status=Reservation.ReservationStatus.CONSUMED).aexists())
+
+    async def test_failed(self):
+        payment, _ = await self.pay(gateway.FAILED)
+        self.assertEqual(payment.payment_status, Payment.PaymentStatus.FAILED)
+        self.assertEqual(await ProductInstance.objects.filter(stock=5).acount(), 2)
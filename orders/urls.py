@@ -7,7 +7,11 @@ from utils.default_string import U, T
 
 router = routers.DefaultRouter()
 router.register("cart", views.CartViewSet, basename=U.V1_CART)
+router.register("orders", views.OrderViewSet, basename=U.V1_ORDER)
+router.register("payment", views.CreatePaymnetViewSet, basename=U.V1_PAYMENT)
 
 urlpatterns = [
+    path("payment/<int:pk>/start/", views.start_payment, name=U.V1_PAYMENT_START),
+    path("payment/callback/", views.payment_callback, name=U.V1_PAYMENT_CALLBACK),
     path("", include(router.urls))
 ]
@@ -1,16 +1,26 @@
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from drf_yasg.utils import swagger_auto_schema
 
-from rest_framework import mixins, viewsets, status
+from rest_framework import exceptions, mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from .models import Order, OrderItem
+from . import payments
+from .gateway import GatewayError, client as gateway
+from .models import Order, OrderItem, Payment
 from users.models import Cart, CartItem
 
 from .serializers import *
-from utils.views import PostMixin, RetrieveMixin
+from utils.pagination import KeysetPagination
+from utils.views import PostMixin, RetrieveMixin, StreamingListMixin, authenticate, conditional_get
 
-from utils.default_string import T
+from utils.default_string import S, T, U
 from utils.server_utils import token_generator
 
 
@@ -53,6 +63,14 @@ class CartViewSet(PostMixin, RetrieveMixin, viewsets.GenericViewSet, mixins.Upda
         else:
             return SessionCart.objects.filter(session=self.request.session.session_key)
     
+    def get_validators(self):
+        if self.action != "get_cart":
+            return None
+        cart = self.get_or_create_cart()
+        items = cart.items.aggregate(update_dt=Max(S.UPDATE_DT), count=Count(S.ID))
+        last_modified = max(date for date in [cart.update_dt, items["update_dt"]] if date is not None)
+        return last_modified, (cart._meta.label, cart.pk, cart.update_dt, items["update_dt"], items["count"])
+
     def get_object(self):
         if self.action in ["update_cart_item", "remove_from_cart"]:
             return self.get_or_create_cart().items.get(product=self.request.data.get("product"))
@@ -81,15 +99,36 @@ class CartViewSet(PostMixin, RetrieveMixin, viewsets.GenericViewSet, mixins.Upda
         tags=[T.CART_TAG]
     )
     @action(detail=False, methods=['get'])
+    @conditional_get
     def get_cart(self, request, *args, **kwargs):
         return self.custom_retrieve(request, *args, **kwargs)
 
 
+class OrderViewSet(StreamingListMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+        Order history of the logged in user, newest first
+    """
+    serializer_class = UserOrdersSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user)
+
+    @swagger_auto_schema(
+        operation_summary="Get Order History",
+        tags=[T.ORDER_TAG]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
 class CreatePaymnetViewSet(PostMixin, RetrieveMixin, viewsets.GenericViewSet):
     """
         Viewsets to create and show orders
     """
     serializer_class = StartPaymentSerializer
+    permission_classes = [IsAuthenticated]
     
     @swagger_auto_schema(
         operation_summary="Start Payment",
@@ -97,7 +136,53 @@ class CreatePaymnetViewSet(PostMixin, RetrieveMixin, viewsets.GenericViewSet):
     )
     @action(detail=False, methods=['post'])
     def create_payment(self, request, *args, **kwargs):
-        return self.custom_create(request, *args, **kwargs)
+        context = self.get_serializer_context()
+        response = self.custom_create(request, context=context)
+        if S.TIMINGS in context:
+            response["Server-Timing"] = context[S.TIMINGS].server_timing()
+        return response
+
+
+def error_response(exc):
+    return JsonResponse({"detail": exc.detail}, status=exc.status_code)
 
 
-# class SuccessfullPaymentVieset()
\ No newline at end of file
+@csrf_exempt
+@require_POST
+async def start_payment(request, pk):
+    """
+        Register a new payment of the user with the gateway, answers the URL where the user pays
+    """
+    try:
+        user = await sync_to_async(authenticate)(request)
+    except exceptions.APIException as e:
+        return error_response(e)
+    payment = await Payment.objects.select_related(S.ORDER).filter(
+        pk=pk, user=user, payment_status=Payment.PaymentStatus.NEW).afirst()
+    if payment is None:
+        return error_response(exceptions.NotFound())
+    try:
+        answer = await gateway.create(payment, request.build_absolute_uri(reverse(U.V1_PAYMENT_CALLBACK)))
+    except GatewayError as e:
+        return error_response(e)
+    await Payment.objects.filter(pk=pk).aupdate(reference=answer[S.REFERENCE], update_dt=timezone.now())
+    return JsonResponse({S.REFERENCE: answer[S.REFERENCE], S.URL: answer[S.URL]})
+
+
+@require_GET
+async def payment_callback(request):
+    """
+        The gateway sends the user back here, the status is verified with the gateway and never taken
+        from the query string
+    """
+    reference = request.GET.get(S.REFERENCE)
+    payment = reference and await Payment.objects.filter(reference=reference).afirst()
+    if not payment:
+        return error_response(exceptions.NotFound())
+    if payment.payment_status == Payment.PaymentStatus.NEW:
+        try:
+            gateway_status = await gateway.verify(reference)
+        except GatewayError as e:
+            return error_response(e)
+        payment = await sync_to_async(payments.settle)(payment.pk, gateway_status)
+    return JsonResponse({S.REFERENCE: reference, S.PAYMENT_STATUS: payment.payment_status})
\ No newline at end of file
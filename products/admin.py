@@ -50,21 +50,16 @@ class ProductInstaceInline (admin.TabularInline):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = [S.NAME, S.CATEGORY, S.RATE, S.PRICE, S.MATERIAL, 'in_stock']
+    list_display = [S.NAME, S.CATEGORY, S.RATE, S.RATE_COUNT, S.PRICE, S.MATERIAL, S.STOCK, S.IN_STOCK]
     search_fields = [S.NAME, S.CATEGORY]
-    list_filter = [S.CATEGORY, S.PRICE, S.RATE]
+    list_filter = [S.CATEGORY, S.PRICE, S.RATE, S.IN_STOCK]
+    readonly_fields = [S.RATE, S.RATE_COUNT]
 
     inlines = [ProductInstaceInline, AlbumInline]
-
-    def in_stock(self, obj):
-        for instance in obj.instances.all():
-            if instance.stock>0:
-                return "Yes"
-        return "No"
     
     fieldsets = (
         (None, {
-            'fields': (S.NAME, S.CATEGORY, S.RATE, S.PRICE, S.MATERIAL, S.DESCRIPTION, S.IMAGE)
+            'fields': (S.NAME, S.CATEGORY, S.RATE, S.RATE_COUNT, S.PRICE, S.MATERIAL, S.DESCRIPTION, S.IMAGE)
         }),
     )
 
@@ -72,7 +67,8 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(ProductInstance)
 class ProductInstanceAdmin (admin.ModelAdmin):
     list_display = [S.PRODUCT, S.STOCK, S.COLOR, S.SIZE, S.P_ID]
-    search_fields = [S.PRODUCT, S.COLOR, S.P_ID]
+    search_fields = [f"{S.P_ID}__exact"]
+    list_select_related = [S.PRODUCT, S.COLOR, S.SIZE]
     list_filter = [S.STOCK, S.SIZE]
 
     fieldsets = (
@@ -91,4 +87,30 @@ class ProductAlbumAdmin (admin.ModelAdmin):
         (None, {
             'fields': (S.PRODUCT, S.FILE)
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(CategoryFacet)
+class CategoryFacetAdmin (admin.ModelAdmin):
+    list_display = [S.CATEGORY, S.PRODUCT_COUNT, S.IN_STOCK_COUNT, S.UPDATE_DT]
+    readonly_fields = [S.CATEGORY, S.COLORS, S.MATERIALS, S.SIZES, S.PRICES, S.PRODUCT_COUNT, S.IN_STOCK_COUNT]
+
+
+@admin.register(ProductDocument)
+class ProductDocumentAdmin (admin.ModelAdmin):
+    list_display = [S.PRODUCT, S.UPDATE_DT]
+    readonly_fields = [S.PRODUCT, S.DETAIL, S.CARD]
+
+
+@admin.register(Comment)
+class CommentAdmin (admin.ModelAdmin):
+    list_display = [S.PRODUCT, S.USER, S.RATING, S.IS_ACTIVE, S.INSERT_DT]
+    list_filter = [S.RATING, S.IS_ACTIVE]
+    raw_id_fields = [S.PRODUCT, S.USER]
+
+
+@admin.register(ProductSimilarity)
+class ProductSimilarityAdmin (admin.ModelAdmin):
+    list_display = [S.PRODUCT, S.IS_STALE, S.UPDATE_DT]
+    list_filter = [S.IS_STALE]
+    readonly_fields = [S.PRODUCT, S.SIMILAR, S.SCORES]
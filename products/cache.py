@@ -0,0 +1,30 @@
+"""
+    Response cache namespaces of the catalog
+"""
+
+from utils.cache import bump_on_commit
+
+CATALOG = "catalog"
+ATTRIBUTES = "attributes"
+
+
+def product_namespace(pk):
+    return f"product:{pk}"
+
+
+def invalidate_products(*product_ids):
+    """
+        Lists and the detail pages of the given products
+    """
+    bump_on_commit(CATALOG, *[product_namespace(pk) for pk in product_ids if pk is not None])
+
+
+def invalidate_catalog():
+    bump_on_commit(CATALOG)
+
+
+def invalidate_attributes():
+    """
+        Color, material and size names appear in every product page
+    """
+    bump_on_commit(CATALOG, ATTRIBUTES)
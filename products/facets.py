@@ -0,0 +1,102 @@
+"""
+    Incremental maintenance of CategoryFacet rows.
+    Every Product/ProductInstance change is turned into per category count deltas.
+"""
+
+from collections import Counter, defaultdict
+
+from utils.default_string import S
+
+
+class FacetDelta:
+    """
+        Count changes for one category facet
+    """
+
+    def __init__(self):
+        self.colors = Counter()
+        self.materials = Counter()
+        self.sizes = Counter()
+        self.prices = Counter()
+        self.product_count = 0
+        self.in_stock_count = 0
+
+    def add_product(self, material_id, price, in_stock, sign=1):
+        self.product_count += sign
+        self.materials[str(material_id)] += sign
+        self.prices[str(price)] += sign
+        self.in_stock_count += sign * int(in_stock)
+
+    def add_instance(self, color_id, size_id, sign=1):
+        self.colors[str(color_id)] += sign
+        self.sizes[str(size_id)] += sign
+
+    def is_empty(self):
+        return not (self.product_count or self.in_stock_count or any(self.colors.values())
+                    or any(self.materials.values()) or any(self.sizes.values()) or any(self.prices.values()))
+
+
+def apply_deltas(deltas):
+    from .models import CategoryFacet
+
+    for category_id, delta in sorted(deltas.items()):
+        if category_id is not None and not delta.is_empty():
+            CategoryFacet.apply(category_id, delta)
+
+
+def product_has_stock(product_id):
+    from .models import Product
+
+    return Product.objects.filter(pk=product_id, in_stock=True).exists()
+
+
+def product_instances(product_id):
+    from .models import ProductInstance
+
+    return ProductInstance.objects.filter(product_id=product_id).values_list(S.COLOR, S.SIZE)
+
+
+def product_changed(product, deleted=False):
+    """
+        Move the product contribution from its loaded values to its current ones
+    """
+    old = product.loaded_values
+    new = None if deleted else {S.CATEGORY: product.category_id, S.MATERIAL: product.material_id,
+                                S.PRICE: product.price}
+    if old == new:
+        return
+    moved = old is not None and (new is None or old[S.CATEGORY] != new[S.CATEGORY])
+    in_stock = product_has_stock(product.pk) if moved else False
+    deltas = defaultdict(FacetDelta)
+    if old is not None:
+        deltas[old[S.CATEGORY]].add_product(old[S.MATERIAL], old[S.PRICE], in_stock, sign=-1)
+    if new is not None:
+        deltas[new[S.CATEGORY]].add_product(new[S.MATERIAL], new[S.PRICE], in_stock)
+    if moved and new is not None:
+        # the instances follow the product, their colors and sizes move with it
+        for color_id, size_id in product_instances(product.pk):
+            deltas[old[S.CATEGORY]].add_instance(color_id, size_id, sign=-1)
+            deltas[new[S.CATEGORY]].add_instance(color_id, size_id)
+    apply_deltas(deltas)
+
+
+def instance_changed(instance, deleted=False):
+    """
+        Move the instance colors and sizes, in stock counts follow products.stock.recalculate
+    """
+    from .models import Product
+
+    keys = (S.PRODUCT, S.COLOR, S.SIZE)
+    old = instance.loaded_values and {key: instance.loaded_values[key] for key in keys}
+    new = None if deleted else {S.PRODUCT: instance.product_id, S.COLOR: instance.color_id, S.SIZE: instance.size_id}
+    if old == new:
+        return
+    product_ids = {state[S.PRODUCT] for state in (old, new) if state is not None}
+    categories = dict(Product.objects.filter(pk__in=product_ids).values_list(S.ID, S.CATEGORY))
+
+    deltas = defaultdict(FacetDelta)
+    if old is not None:
+        deltas[categories.get(old[S.PRODUCT])].add_instance(old[S.COLOR], old[S.SIZE], sign=-1)
+    if new is not None:
+        deltas[categories.get(new[S.PRODUCT])].add_instance(new[S.COLOR], new[S.SIZE])
+    apply_deltas(deltas)
@@ -7,7 +7,7 @@ from utils.default_string import S
 class ProductFilter(filters.FilterSet):
     min_price = filters.NumberFilter(field_name="price", lookup_expr='gte')
     max_price = filters.NumberFilter(field_name="price", lookup_expr='lte')
-    colors = filters.BaseInFilter(field_name="color__id")
+    colors = filters.BaseInFilter(field_name="instances__color__id", distinct=True)
     materials = filters.BaseInFilter(field_name="material__id")
     has_stock = filters.BooleanFilter(method="filter_has_stock")
 
@@ -16,6 +16,4 @@ class ProductFilter(filters.FilterSet):
         fields = [S.CATEGORY, S.COLORS, S.MATERIALS, 'min_price', 'max_price', 'has_stock']
 
     def filter_has_stock(self, queryset, name, value):
-        if value:
-            return queryset.filter(stock__gt=0)
-        return queryset.filter(stock__lte=0)
\ No newline at end of file
+        return queryset.filter(in_stock=value)
\ No newline at end of file
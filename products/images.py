@@ -0,0 +1,88 @@
+"""
+    Resized derivatives of product images. Web workers never build them, the build_image_variants
+    command run periodically derives every image whose variants are missing or stale, so nothing
+    queued is lost when a worker restarts. Serializers show the original until then.
+"""
+
+import io
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+VARIANTS = {
+    "thumbnail": (240, 240),
+    "card": (640, 640),
+    "zoom": (1600, 1600),
+}
+FORMAT = "WEBP"
+QUALITY = 80
+SOURCE = "source"
+
+
+def variant_name(name, variant):
+    root, _ = os.path.splitext(name)
+    return f"{root}__{variant}.{FORMAT.lower()}"
+
+
+def derive(name, force=False):
+    """
+        Build every missing variant of a stored image next to it and return {variant: storage name}.
+        Runs in worker processes, so it only touches storage, never the database.
+    """
+    from PIL import Image, ImageOps
+
+    variants = {SOURCE: name}
+    original = None
+    for variant, size in VARIANTS.items():
+        target = variant_name(name, variant)
+        variants[variant] = target
+        if not force and default_storage.exists(target):
+            continue
+        if original is None:
+            with default_storage.open(name, "rb") as file:
+                original = ImageOps.exif_transpose(Image.open(file))
+                original.load()
+            if original.mode not in ("RGB", "RGBA"):
+                original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, FORMAT, quality=QUALITY, method=4)
+        if default_storage.exists(target):
+            default_storage.delete(target)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def store(model, pk, field, variants):
+    """
+        Save derived names unless the source file changed meanwhile
+    """
+    from .cache import invalidate_products
+    from .models import ProductDocument
+
+    rows = model.objects.filter(pk=pk, **{field: variants[SOURCE]})
+    updated = rows.update(**{f"{field}_variants": variants})
+    if updated:
+        product_ids = list(rows.values_list("product_id" if hasattr(model, "product_id") else "pk", flat=True))
+        ProductDocument.rebuild(product_ids)
+        invalidate_products(*product_ids)
+    return updated
+
+
+def is_current(name, variants):
+    return bool(name) and (variants or {}).get(SOURCE) == name and all(variant in variants for variant in VARIANTS)
+
+
+def image_urls(name, variants):
+    """
+        {variant: url} for the serializers, variants not built yet fall back to the original
+    """
+    if not name:
+        return None
+    variants = variants if is_current(name, variants) else {}
+    urls = {"original": default_storage.url(name)}
+    for variant in VARIANTS:
+        urls[variant] = default_storage.url(variants[variant]) if variant in variants else urls["original"]
+    return urls
@@ -0,0 +1,250 @@
+"""
+    Batched catalog import from CSV/JSONL feeds
+"""
+
+import csv
+import gzip
+import json
+from collections import Counter
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, CategoryFacet, Color, Material, Product, ProductAlbum, ProductDocument, ProductInstance, \
+    Size
+from .cache import invalidate_catalog, invalidate_products
+from .search import get_search_backend
+from .similarity import mark_stale
+
+from utils.default_string import S
+
+
+def read_records(path):
+    """
+        Yield feed rows as dicts, .csv or .jsonl, optionally gzipped
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="") as file:
+        if path.removesuffix(".gz").endswith(".csv"):
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class InvalidRecord (ValueError):
+    pass
+
+
+def required(record, field):
+    value = record.get(field)
+    if value is None or not str(value).strip():
+        raise InvalidRecord(f"{field} is required")
+    return value
+
+
+def non_negative_integer(record, field, default=None):
+    value = record.get(field)
+    if value in (None, "") and default is not None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = -1
+    if value < 0:
+        raise InvalidRecord(f"{field} must be a non negative integer, got {record.get(field)!r}")
+    return value
+
+
+def batches(records, size):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+class CatalogImporter:
+    """
+        Upsert one entity type per feed in batches, every batch in its own transaction.
+        Natural keys: category name, (category, product name), instance p_id, (product, album file).
+        Every record is validated first, invalid ones are skipped and reported by feed position.
+    """
+    ENTITIES = (S.CATEGORIES, S.PRODUCTS, S.INSTANCES, S.ALBUMS)
+
+    def __init__(self, entity, dry_run=False, offset=0):
+        self.entity = entity
+        self.dry_run = dry_run
+        self.position = offset
+        self.stats = Counter()
+        self.rejected = []
+        self.touched_categories = set()
+        self.load_cache()
+
+    def load_cache(self):
+        self.categories = dict(Category.objects.values_list(S.NAME, S.ID))
+        self.colors = dict(Color.objects.values_list(S.NAME, S.ID))
+        self.materials = dict(Material.objects.values_list(S.NAME, S.ID))
+        self.sizes = dict(Size.objects.values_list(S.NAME, S.ID))
+        self.products = {}
+        if self.entity != S.CATEGORIES:
+            self.products = {
+                (category_id, name): pk for pk, category_id, name in Product.objects.values_list(S.ID, S.CATEGORY, S.NAME)
+            }
+
+    def attribute_id(self, model, cache, name):
+        """
+            Id of a color, material or size by name, created on first use
+        """
+        if not name:
+            return None
+        if name not in cache:
+            cache[name] = None if self.dry_run else model.objects.create(name=name).pk
+        return cache[name]
+
+    def product_id(self, record):
+        category_id = self.categories.get(record.get(S.CATEGORY))
+        return self.products.get((category_id, record.get(S.PRODUCT)))
+
+    def clean(self, records):
+        """
+            Valid records of a batch, (position, error) of every invalid one is added to rejected
+        """
+        clean_record = getattr(self, f"clean_{self.entity}")
+        cleaned = []
+        for record in records:
+            self.position += 1
+            try:
+                cleaned.append(clean_record(record))
+            except InvalidRecord as e:
+                self.rejected.append((self.position, str(e)))
+                self.stats["skipped"] += 1
+        return cleaned
+
+    def require_product(self, record):
+        if self.product_id(record) is None:
+            raise InvalidRecord(f"unknown {S.PRODUCT} {record.get(S.PRODUCT)!r} in {record.get(S.CATEGORY)!r}")
+
+    def import_batch(self, records):
+        records = self.clean(records)
+        with transaction.atomic():
+            product_ids = getattr(self, f"import_{self.entity}")(records)
+            if self.dry_run:
+                return
+            if product_ids:
+                products = Product.objects.filter(pk__in=product_ids)
+                products.recalculate_stock()
+                get_search_backend().reindex(products)
+                ProductDocument.rebuild(product_ids)
+                if self.entity != S.ALBUMS:
+                    mark_stale(product_ids)
+            invalidate_products(*product_ids)
+
+    def finish(self):
+        """
+            Rebuild what bulk writes skipped: category facets and attributes
+        """
+        if self.dry_run or not self.touched_categories:
+            return
+        CategoryFacet.rebuild(self.touched_categories)
+        Category.rebuild_attributes()
+        invalidate_catalog()
+
+    def upsert(self, model, existing, new, fields):
+        now = timezone.now()
+        for row in existing:
+            row.update_dt = now
+        self.stats["updated"] += len(existing)
+        self.stats["created"] += len(new)
+        if self.dry_run:
+            return new
+        if existing:
+            model.objects.bulk_update(existing, [*fields, S.UPDATE_DT])
+        return model.objects.bulk_create(new)
+
+    def clean_categories(self, record):
+        gender = str(required(record, S.GENDER)).strip()
+        if gender.isdigit() and int(gender) in Category.Genders.values:
+            gender = int(gender)
+        elif gender.upper() in Category.Genders.names:
+            gender = Category.Genders[gender.upper()]
+        else:
+            raise InvalidRecord(f"unknown {S.GENDER} {gender!r}")
+        return {**record, S.NAME: required(record, S.NAME), S.GENDER: gender}
+
+    def import_categories(self, records):
+        existing, new = [], []
+        for record in records:
+            category = Category(id=self.categories.get(record[S.NAME]), name=record[S.NAME], gender=record[S.GENDER])
+            (existing if category.id else new).append(category)
+        for category in self.upsert(Category, existing, new, [S.GENDER]):
+            self.categories[category.name] = category.pk
+        return set()
+
+    def clean_products(self, record):
+        if required(record, S.CATEGORY) not in self.categories:
+            raise InvalidRecord(f"unknown {S.CATEGORY} {record[S.CATEGORY]!r}")
+        required(record, S.MATERIAL)
+        return {**record, S.NAME: required(record, S.NAME), S.PRICE: non_negative_integer(record, S.PRICE)}
+
+    def import_products(self, records):
+        existing, new = [], []
+        for record in records:
+            category_id = self.categories[record[S.CATEGORY]]
+            material_id = self.attribute_id(Material, self.materials, record[S.MATERIAL])
+            product = Product(
+                id=self.products.get((category_id, record[S.NAME])), name=record[S.NAME], category_id=category_id,
+                material_id=material_id, price=record[S.PRICE], description=record.get(S.DESCRIPTION) or None,
+                image=record.get(S.IMAGE) or None,
+            )
+            (existing if product.id else new).append(product)
+            self.touched_categories.add(category_id)
+        for product in self.upsert(Product, existing, new, [S.MATERIAL, S.PRICE, S.DESCRIPTION, S.IMAGE]):
+            self.products[(product.category_id, product.name)] = product.pk
+        return {product.pk for product in existing + new if product.pk}
+
+    def clean_instances(self, record):
+        required(record, S.P_ID)
+        self.require_product(record)
+        required(record, S.COLOR)
+        required(record, S.SIZE)
+        return {**record, S.STOCK: non_negative_integer(record, S.STOCK, default=0)}
+
+    def import_instances(self, records):
+        # p_id is unique, the last row of a repeated SKU wins
+        records = list({record[S.P_ID]: record for record in records}.values())
+        current = {
+            p_id: (pk, product_id) for p_id, pk, product_id in ProductInstance.objects.filter(
+                p_id__in=[record[S.P_ID] for record in records]).values_list(S.P_ID, S.ID, S.PRODUCT)
+        }
+        product_ids = {product_id for _, product_id in current.values()}
+        existing, new = [], []
+        for record in records:
+            product_id = self.product_id(record)
+            color_id = self.attribute_id(Color, self.colors, record[S.COLOR])
+            size_id = self.attribute_id(Size, self.sizes, record[S.SIZE])
+            pk, _ = current.get(record[S.P_ID], (None, None))
+            instance = ProductInstance(id=pk, p_id=record[S.P_ID], product_id=product_id, color_id=color_id,
+                                       size_id=size_id, stock=record[S.STOCK])
+            (existing if pk else new).append(instance)
+            product_ids.add(product_id)
+        self.upsert(ProductInstance, existing, new, [S.PRODUCT, S.COLOR, S.SIZE, S.STOCK])
+        self.touched_categories.update(
+            Product.objects.filter(pk__in=product_ids).values_list(S.CATEGORY, flat=True).distinct())
+        return product_ids
+
+    def clean_albums(self, record):
+        required(record, S.FILE)
+        self.require_product(record)
+        return record
+
+    def import_albums(self, records):
+        resolved = {(self.product_id(record), record[S.FILE]) for record in records}
+        current = set(ProductAlbum.objects.filter(
+            product_id__in={product_id for product_id, _ in resolved},
+            file__in={file for _, file in resolved},
+        ).values_list(S.PRODUCT, S.FILE))
+        new = [ProductAlbum(product_id=product_id, file=file) for product_id, file in resolved - current]
+        self.stats["unchanged"] += len(resolved & current)
+        self.upsert(ProductAlbum, [], new, [])
+        return {album.product_id for album in new}
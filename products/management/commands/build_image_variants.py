@@ -0,0 +1,48 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+
+from products import images
+from products.models import Product, ProductAlbum
+
+from utils.default_string import S
+
+
+class Command(BaseCommand):
+    help = "Build missing or stale resized variants of product images and album files, run it periodically"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--force", action="store_true", help="Rebuild variants that already exist")
+
+    def pending(self, model, field, force):
+        rows = model.objects.exclude(**{field: ""}).exclude(**{f"{field}__isnull": True}).order_by(S.ID)
+        if not force:
+            rows = rows.alias(source=KeyTextTransform(images.SOURCE, f"{field}_variants")).filter(
+                Q(source__isnull=True) | ~Q(source=F(field)))
+        for pk, name, variants in rows.values_list(S.ID, field, f"{field}_variants").iterator(chunk_size=1000):
+            if force or not images.is_current(name, variants):
+                yield pk, name
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options["workers"]) as executor:
+            for model, field in [(Product, S.IMAGE), (ProductAlbum, S.FILE)]:
+                done = failed = 0
+                pending = self.pending(model, field, options["force"])
+                while True:
+                    batch = [pair for pair, _ in zip(pending, range(options["batch_size"]))]
+                    if not batch:
+                        break
+                    futures = {executor.submit(images.derive, name, options["force"]): pk for pk, name in batch}
+                    for future in as_completed(futures):
+                        try:
+                            images.store(model, futures[future], field, future.result())
+                            done += 1
+                        except Exception as e:
+                            failed += 1
+                            self.stderr.write(f"{model.__name__} {futures[future]}: {e}")
+                    self.stdout.write(f"{model.__name__}: {done} built, {failed} failed")
+        self.stdout.write(self.style.SUCCESS("image variants built"))
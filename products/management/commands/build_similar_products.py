@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.similarity import build
+
+
+class Command(BaseCommand):
+    help = "Rescore similar products of stale products and of the neighbours they affect"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="rescore every product")
+        parser.add_argument("--top-k", type=int, default=None, help="defaults to SIMILAR_PRODUCTS_COUNT")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = build(everything=options["all"], size=options["top_k"], batch_size=options["batch_size"])
+        if count:
+            invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"rescored similar products of {count} products"))
@@ -0,0 +1,32 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from products.importer import CatalogImporter, batches, read_records
+
+
+class Command(BaseCommand):
+    help = "Upsert categories, products, product instances or album files from a CSV/JSONL feed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("entity", choices=CatalogImporter.ENTITIES)
+        parser.add_argument("path", help=".csv or .jsonl file, optionally .gz")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--offset", type=int, default=0, help="Skip the first records, to resume a stopped import")
+        parser.add_argument("--dry-run", action="store_true", help="Resolve and count without writing")
+
+    def handle(self, *args, **options):
+        offset = options["offset"]
+        importer = CatalogImporter(options["entity"], dry_run=options["dry_run"], offset=offset)
+        records = islice(read_records(options["path"]), offset, None)
+        for batch in batches(records, options["batch_size"]):
+            importer.import_batch(batch)
+            offset += len(batch)
+            for position, error in importer.rejected:
+                self.stderr.write(f"record {position} skipped: {error}")
+            importer.rejected.clear()
+            stats = ", ".join(f"{key} {value}" for key, value in sorted(importer.stats.items()))
+            self.stdout.write(f"{options['entity']}: {offset} records ({stats}), resume with --offset {offset}")
+        importer.finish()
+        prefix = "dry run, nothing written: " if options["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}imported {options['entity']} up to record {offset}"))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import Category
+
+
+class Command(BaseCommand):
+    help = "Recompute Category colors and materials from product instances"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = Category.rebuild_attributes(batch_size=options["batch_size"])
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"rebuilt attributes of {count} categories"))
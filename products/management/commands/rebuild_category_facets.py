@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import CategoryFacet
+
+
+class Command(BaseCommand):
+    help = "Recompute category filter facets from products and product instances"
+
+    def add_arguments(self, parser):
+        parser.add_argument("category_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        count = CategoryFacet.rebuild(options["category_ids"] or None)
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"rebuilt {count} category facets"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import Product, ProductDocument
+
+
+class Command(BaseCommand):
+    help = "Render stored product documents of the whole catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        product_ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        done = 0
+        for start in range(0, len(product_ids), batch_size):
+            done += ProductDocument.rebuild(product_ids[start:start + batch_size])
+            self.stdout.write(f"rendered {done}/{len(product_ids)}")
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS("product documents rebuilt"))
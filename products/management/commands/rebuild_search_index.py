@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import Product
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild product search documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.install()
+        batch_size = options["batch_size"]
+        product_ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        for start in range(0, len(product_ids), batch_size):
+            backend.reindex(Product.objects.filter(pk__in=product_ids[start:start + batch_size]))
+            self.stdout.write(f"indexed {min(start + batch_size, len(product_ids))}/{len(product_ids)}")
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS("search index rebuilt"))
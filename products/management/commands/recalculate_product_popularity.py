@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.popularity import buffer, recalculate_popularity
+
+
+class Command(BaseCommand):
+    help = "Restart decayed popularity scores from the total view counts"
+
+    def handle(self, *args, **options):
+        buffer.flush()
+        count = recalculate_popularity()
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"recalculated popularity of {count} products"))
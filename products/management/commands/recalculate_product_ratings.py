@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import Product, ProductDocument
+
+
+class Command(BaseCommand):
+    help = "Recompute Product rate and rate count from active comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = Product.objects.recalculate_rating()
+        batch_size = options["batch_size"]
+        product_ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+        for start in range(0, len(product_ids), batch_size):
+            ProductDocument.rebuild(product_ids[start:start + batch_size])
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"recalculated rating of {count} products"))
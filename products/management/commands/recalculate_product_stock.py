@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from products.cache import invalidate_catalog
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute Product stock and in_stock from product instances"
+
+    def handle(self, *args, **options):
+        count = Product.objects.recalculate_stock()
+        invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS(f"recalculated stock of {count} products"))
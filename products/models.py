@@ -1,12 +1,68 @@
+from collections import Counter
 from functools import cached_property
 from colorfield.fields import ColorField
 
-from django.db import models
+from django.conf import settings
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, ExpressionWrapper, F, Func, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Now, NullIf
+from django.db.models.lookups import GreaterThan
 from django_autoutils.model_utils import AbstractModel, upload_file
 from django.utils.translation import gettext_lazy as _
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 from utils.default_string import S, D
+from utils.models import TrackFieldsMixin
+
+
+class CategoryQuerySet (models.QuerySet):
+    """
+        Category QuerySet with the related loading each serializer needs
+    """
+
+    def with_products(self):
+        """
+            Categories with their products for CategorySerializer
+        """
+        return self.prefetch_related(models.Prefetch(S.PRODUCTS, queryset=Product.objects.for_list()))
+
+    def with_preview(self, size):
+        """
+            Categories with their product count and newest `size` products for CategorySummarySerializer
+        """
+        preview = Product.objects.for_list().order_by(f"-{S.INSERT_DT}", f"-{S.ID}")[:size]
+        return self.select_related(S.FACET).prefetch_related(
+            models.Prefetch(S.PRODUCTS, queryset=preview, to_attr=S.PREVIEW_PRODUCTS)
+        )
+
+    def with_color(self, color_id):
+        return self.filter(colors__contains=[color_id])
+
+    def with_material(self, material_id):
+        return self.filter(materials__contains=[material_id])
+
+
+def array_append_unique(field_name, value):
+    """
+        array_append only when the value is not already in the array
+    """
+    return Case(
+        When(**{f"{field_name}__contains": [value]}, then=F(field_name)),
+        default=Func(F(field_name), Cast(Value(value), models.IntegerField()), function="array_append"),
+        output_field=ArrayField(models.IntegerField()),
+    )
+
+
+def per_row(values):
+    """
+        {id: value} as an expression, for single statement updates with a different value per row
+    """
+    return Case(*[When(pk=pk, then=Value(value)) for pk, value in values.items()], default=Value(0),
+                output_field=models.IntegerField())
 
 
 class Category (AbstractModel):
@@ -23,19 +79,63 @@ class Category (AbstractModel):
     colors = ArrayField(models.IntegerField(), blank=True, default=list)
     materials = ArrayField(models.IntegerField(), blank=True, default=list)
 
+    objects = CategoryQuerySet.as_manager()
+
     def __str__(self):
         return self.name
     
-    def update_attributes (self , color , material):
-        self.colors.append(color)
-        self.materials.append(material)
+    def save(self, *args, **kwargs):
+        self.colors = sorted(set(self.colors))
+        self.materials = sorted(set(self.materials))
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def add_attributes(cls, category_id, color=None, material=None):
+        """
+            Append color and material ids if absent, in one UPDATE without reading the row
+        """
+        values = {}
+        if color is not None:
+            values[S.COLORS] = array_append_unique(S.COLORS, color)
+        if material is not None:
+            values[S.MATERIALS] = array_append_unique(S.MATERIALS, material)
+        return cls.objects.filter(pk=category_id).update(**values) if values else 0
 
-        self.save(update_fields=[S.COLORS, S.MATERIALS])
+    def update_attributes (self , color , material):
+        self.add_attributes(self.pk, color, material)
+        if color not in self.colors:
+            self.colors.append(color)
+        if material not in self.materials:
+            self.materials.append(material)
+
+    @classmethod
+    def rebuild_attributes(cls, batch_size=500):
+        """
+            Derive colors and materials of every category from its products in one pass
+        """
+        colors = dict(
+            ProductInstance.objects.order_by().values(f"{S.PRODUCT}__{S.CATEGORY}")
+            .annotate(ids=ArrayAgg(S.COLOR, distinct=True)).values_list(f"{S.PRODUCT}__{S.CATEGORY}", "ids")
+        )
+        materials = dict(
+            Product.objects.order_by().values(S.CATEGORY)
+            .annotate(ids=ArrayAgg(S.MATERIAL, distinct=True)).values_list(S.CATEGORY, "ids")
+        )
+        categories = list(cls.objects.only(S.ID, S.COLORS, S.MATERIALS))
+        for category in categories:
+            category.colors = sorted(colors.get(category.pk) or [])
+            category.materials = sorted(materials.get(category.pk) or [])
+        cls.objects.bulk_update(categories, [S.COLORS, S.MATERIALS], batch_size=batch_size)
+        return len(categories)
 
     class Meta:
         db_table = D.CATEGORY
         verbose_name = _("category")
         verbose_name_plural = _("categories")
+        indexes = [
+            GinIndex(name=f"{D.CATEGORY}_colors_gin", fields=[S.COLORS]),
+            GinIndex(name=f"{D.CATEGORY}_materials_gin", fields=[S.MATERIALS]),
+        ]
 
 
 class ProductAttributes (AbstractModel):
@@ -86,18 +186,110 @@ class Size (ProductAttributes):
         verbose_name_plural = _("sizes")
 
 
-class Product (AbstractModel):
+class ProductQuerySet (models.QuerySet):
+    """
+        Product QuerySet with the related loading each serializer needs
+    """
+
+    def for_list(self):
+        """
+            Rows for ProductSerializer, one query whatever the size
+        """
+        return self.select_related(S.MATERIAL)
+
+    def for_cards(self):
+        """
+            Rows for ProductCardSerializer, the stored card when there is one
+        """
+        return self.select_related(S.MATERIAL, S.DOCUMENT)
+
+    def for_detail(self):
+        """
+            Rows for ProductDetailSerializer, fixed number of queries
+        """
+        return self.select_related(S.MATERIAL).prefetch_related(
+            S.ALBUM,
+            models.Prefetch(S.INSTANCES, queryset=ProductInstance.objects.select_related(S.COLOR, S.SIZE)),
+        )
+
+    def add_stock(self, delta):
+        """
+            Shift the aggregate stock by delta, in_stock follows in the same UPDATE
+        """
+        stock = F(S.STOCK) + delta
+        return self.update(
+            stock=stock,
+            in_stock=ExpressionWrapper(GreaterThan(stock, 0), output_field=models.BooleanField()),
+            update_dt=Now(),
+        )
+
+    def add_stocks(self, deltas):
+        """
+            add_stock with a different delta per product, {id: delta} in one UPDATE
+        """
+        stock = F(S.STOCK) + per_row(deltas)
+        return self.filter(pk__in=deltas).update(
+            stock=stock,
+            in_stock=ExpressionWrapper(GreaterThan(stock, 0), output_field=models.BooleanField()),
+            update_dt=Now(),
+        )
+
+    def recalculate_stock(self):
+        """
+            Recompute aggregate stock from instances for every product in the queryset
+        """
+        total = ProductInstance.objects.filter(product=OuterRef(S.PK)).order_by().values(S.PRODUCT).annotate(
+            total=Sum(S.STOCK)).values("total")
+        stocked = ProductInstance.objects.filter(product=OuterRef(S.PK), stock__gt=0)
+        return self.order_by().update(stock=Coalesce(Subquery(total), 0), in_stock=Exists(stocked), update_dt=Now())
+
+    def add_rating(self, total, count):
+        """
+            Shift rating sum and count by the deltas, rate follows in the same UPDATE
+        """
+        rate = ExpressionWrapper(Cast(F(S.RATE_TOTAL) + total, models.FloatField()) / (F(S.RATE_COUNT) + count),
+                                 output_field=models.FloatField())
+        return self.update(
+            rate_total=F(S.RATE_TOTAL) + total,
+            rate_count=F(S.RATE_COUNT) + count,
+            rate=Case(When(rate_count__gt=-count, then=rate), default=Value(0.0)),
+            update_dt=Now(),
+        )
+
+    def recalculate_rating(self):
+        """
+            Recompute rating sum, count and rate from active comments for every product in the queryset
+        """
+        comments = Comment.objects.filter(product=OuterRef(S.PK), is_active=True).order_by().values(S.PRODUCT)
+        total = Coalesce(Subquery(comments.annotate(total=Sum(S.RATING)).values("total")), 0)
+        count = Coalesce(Subquery(comments.annotate(count=Count(S.ID)).values("count")), 0)
+        rate = ExpressionWrapper(Cast(total, models.FloatField()) / NullIf(count, 0), output_field=models.FloatField())
+        return self.order_by().update(rate_total=total, rate_count=count, rate=Coalesce(rate, 0.0), update_dt=Now())
+
+
+class Product (TrackFieldsMixin, AbstractModel):
     """
         Main Product Model
     """
+    TRACKED_FIELDS = (S.CATEGORY, S.MATERIAL, S.PRICE)
 
     name = models.CharField(_("name"), max_length=255)
     category = models.ForeignKey(Category, verbose_name=_("category"), on_delete=models.PROTECT, related_name="products")
-    rate = models.FloatField(_("rate"), default=0.0)
+    rate = models.FloatField(_("rate"), default=0.0, editable=False)
+    rate_total = models.PositiveIntegerField(_("rate total"), default=0, editable=False)
+    rate_count = models.PositiveIntegerField(_("rate count"), default=0, editable=False)
     description = models.TextField(_("description"), blank=True, null=True)
     image = models.FileField(upload_to="Products/", max_length=255, null=True, blank=True)
+    image_variants = models.JSONField(_("image variants"), default=dict, blank=True, editable=False)
     price = models.PositiveIntegerField(_("price"))
     material =  models.ForeignKey(Material, verbose_name=_("material"), on_delete=models.PROTECT, related_name="products")
+    stock = models.PositiveIntegerField(_("stock"), default=0, editable=False)
+    in_stock = models.BooleanField(_("in stock"), default=False, db_index=True, editable=False)
+    views = models.PositiveBigIntegerField(_("views"), default=0, editable=False)
+    popularity = models.FloatField(_("popularity"), default=0.0, editable=False)
+    search_document = SearchVectorField(_("search document"), null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -106,23 +298,64 @@ class Product (AbstractModel):
         db_table = D.PRODUCT
         verbose_name = _("product")
         verbose_name_plural = _("products")
+        indexes = [
+            models.Index(name=f"{D.PRODUCT}_price_id_idx", fields=[S.PRICE, S.ID]),
+            models.Index(name=f"{D.PRODUCT}_rate_id_idx", fields=[S.RATE, S.ID]),
+            models.Index(name=f"{D.PRODUCT}_insert_dt_id_idx", fields=[S.INSERT_DT, S.ID]),
+            models.Index(name=f"{D.PRODUCT}_popularity_id_idx", fields=[S.POPULARITY, S.ID]),
+            models.Index(name=f"{D.PRODUCT}_update_dt_idx", fields=[S.UPDATE_DT]),
+            models.Index(name=f"{D.PRODUCT}_category_in_stock_idx", fields=[S.CATEGORY, S.IN_STOCK]),
+            GinIndex(name=f"{D.PRODUCT}_search_document_gin", fields=[S.SEARCH_DOCUMENT]),
+            GinIndex(name=f"{D.PRODUCT}_name_trigram_gin", fields=[S.NAME], opclasses=["gin_trgm_ops"]),
+        ]
+
+
+class ProductInstanceQuerySet (models.QuerySet):
+    """
+        Stock moves done in SQL, callers hand the moved quantities to products.stock.moved()
+    """
+
+    def lock_in_order(self):
+        """
+            Row locks in id order, a statement touching several rows locks them in scan order otherwise
+        """
+        return list(self.select_for_update().order_by(S.ID).values_list(S.ID, flat=True))
+
+    def take_stock(self, counts):
+        """
+            Decrement {id: count} in one statement, only rows that still have count available are
+            updated, so fewer updated rows than counts means something ran out
+        """
+        available = Q()
+        for pk, count in counts.items():
+            available |= Q(pk=pk, stock__gte=count)
+        return self.filter(available).update(stock=F(S.STOCK) - per_row(counts), update_dt=Now())
+
+    def return_stock(self, counts):
+        return self.filter(pk__in=counts).update(stock=F(S.STOCK) + per_row(counts), update_dt=Now())
 
 
-class ProductInstance (AbstractModel):
+class ProductInstance (TrackFieldsMixin, AbstractModel):
     """
         Different Product Instances Model
     """
+    TRACKED_FIELDS = (S.PRODUCT, S.COLOR, S.SIZE, S.STOCK)
 
     product = models.ForeignKey(Product, verbose_name=_("product"), on_delete=models.PROTECT, related_name="instances")
     stock = models.PositiveIntegerField(_("stock"))
     color = models.ForeignKey(Color, verbose_name=_("color"), on_delete=models.PROTECT, related_name="instances")
     size = models.ForeignKey(Size, verbose_name=_("size"), on_delete=models.PROTECT, related_name="instances")
-    p_id = models.CharField(_("p_id"), max_length=255)
+    p_id = models.CharField(_("p_id"), max_length=255, unique=True)
+
+    objects = ProductInstanceQuerySet.as_manager()
 
     class Meta:
         db_table = D.PRODUCT_INSTANCES
         verbose_name = _("product_instance")
         verbose_name_plural = _("product_instances")
+        indexes = [
+            models.Index(name=f"{D.PRODUCT_INSTANCES}_update_idx", fields=[S.UPDATE_DT]),
+        ]
 
     def __str__(self):
         return self.p_id
@@ -136,6 +369,7 @@ class ProductAlbum (AbstractModel):
 
     product  = models.ForeignKey(Product, verbose_name=_("product"), on_delete=models.CASCADE, related_name="album")
     file = models.FileField(upload_to=upload_file, max_length=255)
+    file_variants = models.JSONField(_("file variants"), default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.product}:{self.id}"
@@ -146,9 +380,187 @@ class ProductAlbum (AbstractModel):
         verbose_name_plural = _("albums")
 
 
-class Comment (AbstractModel):
+class CategoryFacet (AbstractModel):
+    """
+        Filter facets of one category, kept up to date incrementally on product changes
+    """
+    COUNT_FIELDS = (S.COLORS, S.MATERIALS, S.SIZES, S.PRICES)
+
+    category = models.OneToOneField(Category, verbose_name=_("category"), on_delete=models.CASCADE, related_name="facet")
+    colors = models.JSONField(_("colors"), default=dict, blank=True)
+    materials = models.JSONField(_("materials"), default=dict, blank=True)
+    sizes = models.JSONField(_("sizes"), default=dict, blank=True)
+    prices = models.JSONField(_("prices"), default=dict, blank=True)
+    product_count = models.PositiveIntegerField(_("product count"), default=0)
+    in_stock_count = models.PositiveIntegerField(_("in stock count"), default=0)
+
+    def __str__(self):
+        return f"{self.category_id}:facet"
+
+    class Meta:
+        db_table = D.CATEGORY_FACET
+        verbose_name = _("category_facet")
+        verbose_name_plural = _("category_facets")
+
+    @classmethod
+    def apply(cls, category_id, delta):
+        """
+            Add a FacetDelta to the category facet under a row lock
+        """
+        with transaction.atomic():
+            facet, _ = cls.objects.select_for_update().get_or_create(category_id=category_id)
+            for name in cls.COUNT_FIELDS:
+                counts = Counter(getattr(facet, name))
+                counts.update(getattr(delta, name))
+                setattr(facet, name, {key: value for key, value in counts.items() if value > 0})
+            facet.product_count = max(0, facet.product_count + delta.product_count)
+            facet.in_stock_count = max(0, facet.in_stock_count + delta.in_stock_count)
+            facet.save()
+
+    @classmethod
+    def rebuild(cls, category_ids=None):
+        """
+            Recompute facets from scratch with one grouped query per facet
+        """
+        from .facets import FacetDelta
+
+        categories = Category.objects.all()
+        if category_ids is not None:
+            categories = categories.filter(pk__in=category_ids)
+        deltas = {category_id: FacetDelta() for category_id in categories.values_list(S.ID, flat=True)}
+        products = Product.objects.filter(category__in=categories).order_by()
+        instances = ProductInstance.objects.filter(product__category__in=categories).order_by()
+        category_of_instance = f"{S.PRODUCT}__{S.CATEGORY}"
+
+        grouped = [
+            (products, S.CATEGORY, S.MATERIAL, S.MATERIALS),
+            (products, S.CATEGORY, S.PRICE, S.PRICES),
+            (instances, category_of_instance, S.COLOR, S.COLORS),
+            (instances, category_of_instance, S.SIZE, S.SIZES),
+        ]
+        for queryset, category, field, name in grouped:
+            rows = queryset.values(category, field).annotate(count=Count(S.ID)).values_list(category, field, "count")
+            for category_id, value, count in rows:
+                getattr(deltas[category_id], name)[str(value)] += count
+        for category_id, count in products.values(S.CATEGORY).annotate(count=Count(S.ID)).values_list(S.CATEGORY, "count"):
+            deltas[category_id].product_count = count
+        in_stock = products.filter(instances__stock__gt=0).values(S.CATEGORY).annotate(
+            count=Count(S.ID, distinct=True)).values_list(S.CATEGORY, "count")
+        for category_id, count in in_stock:
+            deltas[category_id].in_stock_count = count
+
+        facets = [
+            cls(category_id=category_id, colors=dict(delta.colors), materials=dict(delta.materials),
+                sizes=dict(delta.sizes), prices=dict(delta.prices), product_count=delta.product_count,
+                in_stock_count=delta.in_stock_count)
+            for category_id, delta in deltas.items()
+        ]
+        cls.objects.bulk_create(facets, batch_size=500, update_conflicts=True, unique_fields=[S.CATEGORY],
+                                update_fields=[*cls.COUNT_FIELDS, S.PRODUCT_COUNT, S.IN_STOCK_COUNT, S.UPDATE_DT])
+        return len(facets)
+
+    def price_range(self, buckets):
+        """
+            Min, max and an equal width histogram of product prices
+        """
+        prices = {int(price): count for price, count in self.prices.items()}
+        if not prices:
+            return {'min_price': 0, 'max_price': 0, 'histogram': []}
+        min_price, max_price = min(prices), max(prices)
+        width = max(1, -(-(max_price - min_price + 1) // buckets))
+        histogram = [{'min_price': min_price + index * width, 'max_price': min_price + (index + 1) * width - 1,
+                      'count': 0} for index in range(-(-(max_price - min_price + 1) // width))]
+        for price, count in prices.items():
+            histogram[(price - min_price) // width]['count'] += count
+        return {'min_price': min_price, 'max_price': max_price, 'histogram': histogram}
+
+
+class ProductDocument (AbstractModel):
+    """
+        Rendered product documents, rebuilt with every change of a row they contain
+    """
+
+    product = models.OneToOneField(Product, verbose_name=_("product"), on_delete=models.CASCADE,
+                                   related_name="document", primary_key=True)
+    detail = models.JSONField(_("detail"))
+    card = models.JSONField(_("card"))
+
+    def __str__(self):
+        return f"{self.product_id}:document"
+
+    class Meta:
+        db_table = D.PRODUCT_DOCUMENT
+        verbose_name = _("product_document")
+        verbose_name_plural = _("product_documents")
+
+    @classmethod
+    def rebuild(cls, product_ids):
+        """
+            Render and upsert documents of the given products in one transaction
+        """
+        from .serializers import ProductDetailSerializer, ProductSerializer
+
+        product_ids = list(product_ids)
+        with transaction.atomic():
+            products = list(Product.objects.for_detail().filter(pk__in=product_ids))
+            documents = [
+                cls(product=product, detail=ProductDetailSerializer(product).data,
+                    card=ProductSerializer(product).data)
+                for product in products
+            ]
+            cls.objects.bulk_create(documents, batch_size=500, update_conflicts=True, unique_fields=[S.PRODUCT],
+                                    update_fields=[S.DETAIL, S.CARD, S.UPDATE_DT])
+        return len(documents)
+
+
+class ProductSimilarity (AbstractModel):
+    """
+        Top similar products of one product, best first, refreshed by the build_similar_products job
+    """
+
+    product = models.OneToOneField(Product, verbose_name=_("product"), on_delete=models.CASCADE,
+                                   related_name="similarity", primary_key=True)
+    similar = ArrayField(models.BigIntegerField(), verbose_name=_("similar"), default=list, blank=True)
+    scores = ArrayField(models.FloatField(), verbose_name=_("scores"), default=list, blank=True)
+    is_stale = models.BooleanField(_("is stale"), default=True)
+
+    def __str__(self):
+        return f"{self.product_id}:similar"
+
+    class Meta:
+        db_table = D.PRODUCT_SIMILARITY
+        verbose_name = _("product_similarity")
+        verbose_name_plural = _("product_similarities")
+        indexes = [
+            GinIndex(name=f"{D.PRODUCT_SIMILARITY}_similar_gin", fields=[S.SIMILAR]),
+            models.Index(name=f"{D.PRODUCT_SIMILARITY}_stale_idx", fields=[S.IS_STALE], condition=Q(is_stale=True)),
+        ]
+
+
+class Comment (TrackFieldsMixin, AbstractModel):
     """
-        Product Comment Class
+        Product review of one user, only active comments count towards the product rate
     """
+    TRACKED_FIELDS = (S.PRODUCT, S.RATING, S.IS_ACTIVE)
+
+    product = models.ForeignKey(Product, verbose_name=_("product"), on_delete=models.CASCADE, related_name="comments")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_("user"), on_delete=models.SET_NULL,
+                             related_name="comments", null=True)
+    rating = models.PositiveSmallIntegerField(_("rating"), validators=[MinValueValidator(1), MaxValueValidator(5)])
+    text = models.TextField(_("text"), blank=True, null=True)
 
-    #TODO - To be implemented after user model implementation
\ No newline at end of file
+    def __str__(self):
+        return f"{self.user}:{self.product_id}:{self.rating}"
+
+    class Meta:
+        db_table = D.COMMENT
+        verbose_name = _("comment")
+        verbose_name_plural = _("comments")
+        constraints = [
+            models.UniqueConstraint(name=f"{D.COMMENT}_user_product_unique", fields=[S.USER, S.PRODUCT]),
+            models.CheckConstraint(name=f"{D.COMMENT}_rating_range", condition=Q(rating__gte=1, rating__lte=5)),
+        ]
+        indexes = [
+            models.Index(name=f"{D.COMMENT}_product_recent_idx", fields=[S.PRODUCT, S.INSERT_DT, S.ID],
+                         condition=Q(is_active=True)),
+        ]
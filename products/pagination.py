@@ -0,0 +1,30 @@
+from utils.default_string import S
+from utils.pagination import KeysetPagination
+
+
+class ProductPagination(KeysetPagination):
+    """
+        Keyset pagination on the indexed product sort keys
+    """
+    orderings = {
+        "newest": (f"-{S.INSERT_DT}", f"-{S.ID}"),
+        "cheapest": (S.PRICE, S.ID),
+        "expensive": (f"-{S.PRICE}", f"-{S.ID}"),
+        "top_rated": (f"-{S.RATE}", f"-{S.ID}"),
+        "popular": (f"-{S.POPULARITY}", f"-{S.ID}"),
+    }
+    search_orderings = {
+        **orderings,
+        "relevance": (f"-{S.SEARCH_RANK}", S.ID),
+    }
+    default_ordering = "newest"
+
+
+class CommentPagination(KeysetPagination):
+    """
+        Newest active comments of one product, served from the partial (product, insert_dt, id) index
+    """
+    page_size = 20
+    orderings = {
+        "newest": (f"-{S.INSERT_DT}", f"-{S.ID}"),
+    }
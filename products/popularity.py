@@ -0,0 +1,121 @@
+"""
+    Write-behind product view counters.
+    Views are counted in process memory and flushed every VIEW_COUNTER_FLUSH_SECONDS by a background
+    thread of each process, with one UPDATE ... SET views = views + n per distinct n, the detail page
+    never writes a row of its own. A process that dies loses at most the views of one interval.
+
+    popularity is a forward decayed score: a view at time t adds 2 ** ((t - EPOCH) / HALF_LIFE), so
+    the scores of all products shrink by the same factor as time passes and their order is the
+    decayed order without ever rewriting old rows. Weights overflow a float after about 1000 half-lives,
+    so move EPOCH forward once in a few years; changing EPOCH or HALF_LIFE needs the
+    recalculate_product_popularity command, which only has the total views to start from.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from utils.default_string import S
+
+from .cache import invalidate_catalog
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(days=7)
+
+
+def weight(at=None):
+    return 2 ** (((at or timezone.now()) - EPOCH) / HALF_LIFE)
+
+
+def write(counts, at=None):
+    """
+        Add {product id: views} to the counters, products with the same count share one UPDATE
+    """
+    from .models import Product
+
+    by_count = defaultdict(list)
+    for pk, count in counts.items():
+        by_count[count].append(pk)
+    current = weight(at)
+    for count, product_ids in sorted(by_count.items()):
+        Product.objects.filter(pk__in=sorted(product_ids)).update(
+            views=F(S.VIEWS) + count, popularity=F(S.POPULARITY) + count * current)
+
+
+def recalculate_popularity():
+    """
+        Restart every score as if all past views happened now
+    """
+    from .models import Product
+
+    return Product.objects.update(popularity=F(S.VIEWS) * weight())
+
+
+class ViewBuffer:
+    """
+        Per process view counts, flushed by a daemon thread started with the first view of the process
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def add(self, pk):
+        with self.lock:
+            self.counts[pk] += 1
+            self.start()
+
+    def start(self):
+        # forked workers do not inherit the thread of their parent
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name="product-view-flush", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(min(settings.VIEW_COUNTER_FLUSH_SECONDS, threading.TIMEOUT_MAX))
+            self.flush()
+            connection.close()
+
+    def flush(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        try:
+            write(counts)
+        except Exception as e:
+            logger.error(f"can not flush {sum(counts.values())} product views: {e}")
+            with self.lock:
+                self.counts.update(counts)
+            return
+        # lists sorted by popularity are cached, the detail pages do not show the counters
+        invalidate_catalog()
+
+    def clear(self):
+        with self.lock:
+            self.counts = Counter()
+
+
+buffer = ViewBuffer()
+
+
+def record_view(pk):
+    try:
+        buffer.add(int(pk))
+    except (TypeError, ValueError):
+        pass
@@ -0,0 +1,97 @@
+"""
+    Product full text search over name, description, category and material
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from utils.default_string import S, D
+
+
+class PostgresProductSearch:
+    """
+        tsvector document on Product with a trigram index on name for typo tolerance
+    """
+    CONFIG = "simple"
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def install(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    def document(self):
+        from django.contrib.postgres.search import SearchVector
+
+        return (
+            SearchVector(S.NAME, weight="A", config=self.CONFIG)
+            + SearchVector("category__name", "material__name", weight="B", config=self.CONFIG)
+            + SearchVector(Coalesce(S.DESCRIPTION, Value("")), weight="C", config=self.CONFIG)
+        )
+
+    def reindex(self, queryset):
+        """
+            Rebuild documents of queryset rows in a single UPDATE
+        """
+        from .models import Product
+
+        document = Product.objects.filter(pk=OuterRef("pk")).annotate(document=self.document()).values("document")[:1]
+        return queryset.using(self.using).order_by().update(search_document=Subquery(document))
+
+    def remove(self, product_ids):
+        pass
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+        search_query = SearchQuery(query, search_type="websearch", config=self.CONFIG)
+        rank = SearchRank(F(S.SEARCH_DOCUMENT), search_query) + TrigramWordSimilarity(query, S.NAME)
+        return queryset.annotate(
+            # real does not survive the text round trip of a cursor exactly, double precision does
+            search_rank=Cast(rank, FloatField())
+        ).filter(
+            Q(search_document=search_query) | Q(name__trigram_word_similar=query)
+        ).order_by("-search_rank", S.ID)
+
+
+class BasicProductSearch:
+    """
+        Plain lookups for databases without a text search engine, every word must appear in some field
+        and rows with more words in their name rank first. No index, no typo tolerance.
+    """
+    FIELDS = [S.NAME, S.DESCRIPTION, "category__name", "material__name"]
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def install(self):
+        pass
+
+    def reindex(self, queryset):
+        return 0
+
+    def remove(self, product_ids):
+        pass
+
+    def search(self, queryset, query):
+        words = query.split()
+        for word in words:
+            queryset = queryset.filter(Q(*[Q(**{f"{field}__icontains": word}) for field in self.FIELDS], _connector=Q.OR))
+        in_name = [Case(When(name__icontains=word, then=Value(1.0)), default=Value(0.0)) for word in words]
+        return queryset.annotate(
+            search_rank=sum(in_name, Value(0.0, output_field=FloatField()))
+        ).order_by("-search_rank", S.ID)
+
+
+BACKENDS = {
+    "postgresql": PostgresProductSearch,
+}
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS):
+    """
+        Search backend for the database behind the using alias
+    """
+    return BACKENDS.get(connections[using].vendor, BasicProductSearch)(using)
@@ -1,39 +1,83 @@
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import serializers
 from drf_yasg.utils import swagger_serializer_method
 
-from django.db.models import Min, Max, Count
+from constance import config
 
 from .models import *
+from .images import image_urls
 
 from utils.default_string import S
 
 
+def absolute_media(data, request):
+    """
+        Documents are rendered without a request and keep storage relative media URLs, they get
+        the absolute shape of the live serializers when served
+    """
+    if request is None or not data:
+        return data
+    data = dict(data)
+    for key in (S.IMAGE, S.FILE):
+        if data.get(key):
+            data[key] = request.build_absolute_uri(data[key])
+    for key in ("images", "files"):
+        if data.get(key):
+            data[key] = {name: request.build_absolute_uri(url) for name, url in data[key].items()}
+    if data.get(S.ALBUM):
+        data[S.ALBUM] = [absolute_media(item, request) for item in data[S.ALBUM]]
+    return data
+
+
 class ProductAlbumSeializer (serializers.ModelSerializer):
     """
         Serializer Model for product Album
     """
+    files = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductAlbum
-        fields = [S.ID, S.PRODUCT, S.FILE]
+        fields = [S.ID, S.PRODUCT, S.FILE, 'files']
+
+    def get_files(self, obj):
+        urls = image_urls(obj.file.name, obj.file_variants)
+        return absolute_media({"files": urls}, self.context.get("request"))["files"]
 
 
-class CategoryFilterSerializer (serializers.ModelSerializer):
+class CategoryFilterSerializer (serializers.Serializer):
+    """
+        Category filters served from the category facet row
+    """
+    colors = serializers.SerializerMethodField()
+    materials = serializers.SerializerMethodField()
+    sizes = serializers.SerializerMethodField()
     price_range = serializers.SerializerMethodField()
+    product_count = serializers.IntegerField(source=f"{S.FACET}.{S.PRODUCT_COUNT}", default=0)
+    in_stock_count = serializers.IntegerField(source=f"{S.FACET}.{S.IN_STOCK_COUNT}", default=0)
 
-    class Meta:
-        model = Category
-        fields = [S.COLORS, S.MATERIALS, 'price_range']
+    @staticmethod
+    def get_facet(obj):
+        try:
+            return obj.facet
+        except CategoryFacet.DoesNotExist:
+            return CategoryFacet(category=obj)
+
+    @staticmethod
+    def counts(values):
+        return [{S.ID: int(key), S.COUNT: count} for key, count in sorted(values.items(), key=lambda item: int(item[0]))]
+
+    def get_colors(self, obj):
+        return self.counts(self.get_facet(obj).colors)
+
+    def get_materials(self, obj):
+        return self.counts(self.get_facet(obj).materials)
+
+    def get_sizes(self, obj):
+        return self.counts(self.get_facet(obj).sizes)
 
     def get_price_range(self, obj):
-        products = Product.objects.filter(category=obj)
-        if products.exists():
-            price_range = products.aggregate(Min('price'), Max('price'))
-            return {
-                'min_price': price_range.get('price__min',0),
-                'max_price': price_range.get('price__max',0)
-            }
-        return {'min_price':0, 'max_price':0}
+        return self.get_facet(obj).price_range(config.CATEGORY_PRICE_HISTOGRAM_BUCKETS)
 
 class ColorSerializer (serializers.ModelSerializer):
     class Meta:
@@ -63,25 +107,90 @@ class ProductInstanceSerializer (serializers.ModelSerializer):
         fields = [S.ID, S.STOCK, S.COLOR, S.SIZE]
 
 
-class ProductSerializer (serializers.ModelSerializer):
+class SkuLookupSerializer (serializers.Serializer):
+    """
+        SKUs to resolve in one batch
+    """
+    MAX_SKUS = 500
+
+    p_ids = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False, max_length=MAX_SKUS)
+
+
+class SkuSerializer (serializers.ModelSerializer):
+    """
+        Variant of one SKU with its product, price and stock
+    """
+    product_name = serializers.CharField(source=f"{S.PRODUCT}.{S.NAME}")
+    price = serializers.IntegerField(source=f"{S.PRODUCT}.{S.PRICE}")
+    color = serializers.CharField(source=f"{S.COLOR}.{S.NAME}")
+    size = serializers.CharField(source=f"{S.SIZE}.{S.NAME}")
+
+    class Meta:
+        model = ProductInstance
+        fields = [S.P_ID, S.ID, S.PRODUCT, 'product_name', S.PRICE, S.STOCK, S.COLOR, S.SIZE]
+
+
+class ProductImagesMixin:
+    def get_images(self, obj):
+        urls = image_urls(obj.image.name, obj.image_variants)
+        return absolute_media({"images": urls}, self.context.get("request"))["images"]
+
+
+class ProductSerializer (ProductImagesMixin, serializers.ModelSerializer):
     material = MaterialSerializer()
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = [S.ID, S.NAME, S.PRICE, S.CATEGORY, S.RATE, S.IMAGE, S.MATERIAL]
+        fields = [S.ID, S.NAME, S.PRICE, S.CATEGORY, S.RATE, S.RATE_COUNT, S.IMAGE, 'images', S.MATERIAL, S.IN_STOCK]
+
+
+class ProductCardSerializer (ProductSerializer):
+    """
+        Product list card, read from the stored document when it exists
+    """
+
+    def to_representation(self, instance):
+        document = getattr(instance, S.DOCUMENT, None)
+        if document is not None:
+            return absolute_media(document.card, self.context.get("request"))
+        return super().to_representation(instance)
 
 
-class ProductDetailSerializer (serializers.ModelSerializer):
+class ProductDetailSerializer (ProductImagesMixin, serializers.ModelSerializer):
     """
         Serializer for single product detailed view
     """
     material = MaterialSerializer()
+    images = serializers.SerializerMethodField()
     album = ProductAlbumSeializer(many=True, read_only=True)
     instances = ProductInstanceSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
-        fields = [S.ID, S.NAME, S.PRICE, S.CATEGORY, S.DESCRIPTION, S.RATE, S.IMAGE, S.MATERIAL, S.ALBUM, 'instances']
+        fields = [S.ID, S.NAME, S.PRICE, S.CATEGORY, S.DESCRIPTION, S.RATE, S.RATE_COUNT, S.IMAGE, 'images', S.MATERIAL,
+                  S.IN_STOCK, S.ALBUM, 'instances']
+
+class CommentSerializer (serializers.ModelSerializer):
+    """
+        Product review, the product comes from the url and the user from the request
+    """
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    username = serializers.CharField(source=f"{S.USER}.{S.USERNAME}", read_only=True, default=None)
+
+    class Meta:
+        model = Comment
+        fields = [S.ID, S.USER, S.USERNAME, S.RATING, S.TEXT, S.INSERT_DT]
+        read_only_fields = [S.INSERT_DT]
+
+    def validate(self, attrs):
+        if Comment.objects.filter(user=attrs[S.USER], product=self.context[S.PRODUCT]).exists():
+            raise serializers.ValidationError(_("You have already reviewed this product"))
+        return attrs
+
+    def create(self, validated_data):
+        return super().create({**validated_data, S.PRODUCT: self.context[S.PRODUCT]})
+
 
 class CategorySerializer (serializers.ModelSerializer):
     """
@@ -90,4 +199,18 @@ class CategorySerializer (serializers.ModelSerializer):
     products = ProductSerializer(many=True, read_only=True)
     class Meta:
         model = Category
-        fields = [S.ID, S.NAME, S.GENDER, S.COLORS, S.MATERIALS, 'products']
\ No newline at end of file
+        fields = [S.ID, S.NAME, S.GENDER, S.COLORS, S.MATERIALS, 'products']
+
+
+class CategorySummarySerializer (serializers.ModelSerializer):
+    """
+        Category with its product count and a few newest products instead of the whole catalog
+    """
+    PREVIEW_SIZE = 4
+
+    product_count = serializers.IntegerField(source=f"{S.FACET}.{S.PRODUCT_COUNT}", default=0)
+    preview = ProductSerializer(source=S.PREVIEW_PRODUCTS, many=True, read_only=True)
+
+    class Meta:
+        model = Category
+        fields = [S.ID, S.NAME, S.GENDER, S.COLORS, S.MATERIALS, S.PRODUCT_COUNT, 'preview']
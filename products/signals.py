@@ -0,0 +1,224 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save, pre_migrate
+from django.dispatch import receiver
+
+from . import cache, facets, importer, similarity, stock
+from .models import Category, Color, Comment, Material, Product, ProductAlbum, ProductDocument, ProductInstance, \
+    ProductSimilarity, Size
+from .search import get_search_backend
+
+from utils.default_string import S
+
+DOCUMENT_BATCH_SIZE = 500
+
+
+def deleted_with_product(origin):
+    """
+        True for children removed by the cascade of a product delete, their product is going away too
+    """
+    return isinstance(origin, Product) or getattr(origin, "model", None) is Product
+
+
+@receiver(pre_migrate)
+def install_search_backend(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+        Extensions must exist on the migrated database before the product indexes are created
+    """
+    if sender.name == "products":
+        get_search_backend(using).install()
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if not raw:
+        get_search_backend(using).reindex(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+def remove_product(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    get_search_backend(using).remove([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if not (raw or created):
+        get_search_backend(using).reindex(Product.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=Material)
+def reindex_material_products(sender, instance, created=False, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if not (raw or created):
+        get_search_backend(using).reindex(Product.objects.filter(material=instance))
+
+
+@receiver(post_save, sender=Product)
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.product_changed(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_facets(sender, instance, **kwargs):
+    facets.product_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=ProductInstance)
+def update_instance_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        facets.instance_changed(instance)
+
+
+@receiver(post_delete, sender=ProductInstance)
+def remove_instance_facets(sender, instance, **kwargs):
+    facets.instance_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=ProductInstance)
+def add_category_attributes(sender, instance, raw=False, **kwargs):
+    old = instance.loaded_values
+    if raw or (old and old[S.PRODUCT] == instance.product_id and old[S.COLOR] == instance.color_id):
+        return
+    category_id, material_id = Product.objects.filter(pk=instance.product_id).values_list(S.CATEGORY, S.MATERIAL).get()
+    Category.add_attributes(category_id, color=instance.color_id, material=material_id)
+
+
+@receiver(post_save, sender=Product)
+def add_category_material(sender, instance, raw=False, **kwargs):
+    old = instance.loaded_values
+    if raw or (old and old[S.CATEGORY] == instance.category_id and old[S.MATERIAL] == instance.material_id):
+        return
+    Category.add_attributes(instance.category_id, material=instance.material_id)
+
+
+@receiver(post_save, sender=ProductInstance)
+def update_product_stock(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance.loaded_values
+    if old is None or old[S.PRODUCT] != instance.product_id or old[S.STOCK] != instance.stock:
+        stock.recalculate({instance.product_id, (old or {}).get(S.PRODUCT)})
+
+
+@receiver(post_delete, sender=ProductInstance)
+def remove_product_stock(sender, instance, **kwargs):
+    stock.recalculate([instance.product_id])
+
+
+@receiver(post_save, sender=Comment)
+def update_product_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance.loaded_values
+    old_product = old[S.PRODUCT] if old is not None and old[S.IS_ACTIVE] else None
+    new_product = instance.product_id if instance.is_active else None
+    if old_product is not None and old_product == new_product:
+        if instance.rating != old[S.RATING]:
+            Product.objects.filter(pk=new_product).add_rating(instance.rating - old[S.RATING], 0)
+        return
+    if old_product is not None:
+        Product.objects.filter(pk=old_product).add_rating(-old[S.RATING], -1)
+    if new_product is not None:
+        Product.objects.filter(pk=new_product).add_rating(instance.rating, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def remove_product_rating(sender, instance, origin=None, **kwargs):
+    old = instance.loaded_values
+    if old is not None and old[S.IS_ACTIVE] and not deleted_with_product(origin):
+        Product.objects.filter(pk=old[S.PRODUCT]).add_rating(-old[S.RATING], -1)
+
+
+@receiver(post_save, sender=Product)
+def mark_product_similarity(sender, instance, raw=False, **kwargs):
+    old = instance.loaded_values
+    new = {S.CATEGORY: instance.category_id, S.MATERIAL: instance.material_id, S.PRICE: instance.price}
+    if not raw and old != new:
+        similarity.mark_stale([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_similarity(sender, instance, **kwargs):
+    similarity.mark_stale(ProductSimilarity.objects.filter(similar__contains=[instance.pk]).values_list(
+        S.PRODUCT, flat=True))
+
+
+@receiver(post_save, sender=ProductInstance)
+def mark_instance_similarity(sender, instance, raw=False, **kwargs):
+    old = instance.loaded_values
+    if raw or old and (old[S.PRODUCT], old[S.COLOR], old[S.SIZE]) == (
+            instance.product_id, instance.color_id, instance.size_id):
+        return
+    similarity.mark_stale({instance.product_id, (old or {}).get(S.PRODUCT)})
+
+
+@receiver(post_delete, sender=ProductInstance)
+def remove_instance_similarity(sender, instance, **kwargs):
+    similarity.mark_stale([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductAlbum)
+def invalidate_product(sender, instance, **kwargs):
+    cache.invalidate_products(instance.pk if sender is Product else instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=ProductInstance)
+def invalidate_instance_product(sender, instance, **kwargs):
+    old = instance.loaded_values or {}
+    cache.invalidate_products(instance.product_id, old.get(S.PRODUCT))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    cache.invalidate_catalog()
+
+
+@receiver([post_save, post_delete], sender=Color)
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=Size)
+def invalidate_attribute(sender, instance, **kwargs):
+    cache.invalidate_attributes()
+
+
+@receiver(post_save, sender=Product)
+def rebuild_product_document(sender, instance, raw=False, **kwargs):
+    # registered last, stock and search columns are already up to date
+    if not raw:
+        ProductDocument.rebuild([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=ProductInstance)
+def rebuild_instance_document(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance.loaded_values or {}
+    ProductDocument.rebuild({instance.product_id, old.get(S.PRODUCT)} - {None})
+
+
+@receiver([post_save, post_delete], sender=ProductAlbum)
+def rebuild_album_document(sender, instance, raw=False, origin=None, **kwargs):
+    if not (raw or deleted_with_product(origin)):
+        ProductDocument.rebuild([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def rebuild_comment_document(sender, instance, raw=False, origin=None, **kwargs):
+    # rate is part of the documents, the rating receivers above already ran
+    if raw or deleted_with_product(origin):
+        return
+    old = instance.loaded_values or {}
+    ProductDocument.rebuild({instance.product_id, old.get(S.PRODUCT)} - {None})
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Size)
+def rebuild_attribute_documents(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    products = Product.objects.filter(material=instance) if sender is Material else Product.objects.filter(
+        **{f"instances__{sender._meta.model_name}": instance}).distinct()
+    product_ids = products.values_list(S.ID, flat=True).iterator(chunk_size=DOCUMENT_BATCH_SIZE)
+    for batch in importer.batches(product_ids, DOCUMENT_BATCH_SIZE):
+        ProductDocument.rebuild(batch)
@@ -0,0 +1,128 @@
+"""
+    Precomputed top-K similar products.
+    Writes only mark products stale, the build_similar_products job rescores the stale ones and
+    the neighbours their change can move, everything else keeps its stored list.
+"""
+
+import heapq
+from collections import defaultdict
+
+from constance import config
+
+from utils.default_string import S
+
+WEIGHTS = {
+    S.CATEGORY: 0.4,
+    S.MATERIAL: 0.2,
+    S.COLORS: 0.15,
+    S.SIZES: 0.1,
+    S.PRICE: 0.15,
+}
+
+
+def jaccard(first, second):
+    if not (first or second):
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class Features:
+    """
+        Attributes of every product held in memory, with category and material postings for candidate lookup
+    """
+
+    def __init__(self):
+        from .models import Product, ProductInstance
+
+        self.products = {}
+        self.by_category = defaultdict(set)
+        self.by_material = defaultdict(set)
+        for pk, category_id, material_id, price in Product.objects.values_list(
+                S.ID, S.CATEGORY, S.MATERIAL, S.PRICE).iterator(chunk_size=2000):
+            self.products[pk] = (category_id, material_id, price, set(), set())
+            self.by_category[category_id].add(pk)
+            self.by_material[material_id].add(pk)
+        for product_id, color_id, size_id in ProductInstance.objects.values_list(
+                S.PRODUCT, S.COLOR, S.SIZE).iterator(chunk_size=2000):
+            if product_id in self.products:
+                self.products[product_id][3].add(color_id)
+                self.products[product_id][4].add(size_id)
+
+    def candidates(self, pk):
+        category_id, material_id, *_ = self.products[pk]
+        return (self.by_category[category_id] | self.by_material[material_id]) - {pk}
+
+    def score(self, first, second):
+        category_a, material_a, price_a, colors_a, sizes_a = self.products[first]
+        category_b, material_b, price_b, colors_b, sizes_b = self.products[second]
+        price = 1 - abs(price_a - price_b) / max(price_a, price_b) if max(price_a, price_b) else 1.0
+        return round(
+            WEIGHTS[S.CATEGORY] * (category_a == category_b)
+            + WEIGHTS[S.MATERIAL] * (material_a == material_b)
+            + WEIGHTS[S.COLORS] * jaccard(colors_a, colors_b)
+            + WEIGHTS[S.SIZES] * jaccard(sizes_a, sizes_b)
+            + WEIGHTS[S.PRICE] * price,
+            4,
+        )
+
+    def scores(self, pk):
+        return {other: self.score(pk, other) for other in self.candidates(pk)}
+
+
+def top(scores, size):
+    return heapq.nlargest(size, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def mark_stale(product_ids):
+    """
+        Queue products for the next build, rows are created for products scored for the first time
+    """
+    from .models import ProductSimilarity
+
+    rows = [ProductSimilarity(product_id=pk, is_stale=True) for pk in set(product_ids) - {None}]
+    ProductSimilarity.objects.bulk_create(rows, update_conflicts=True, unique_fields=[S.PRODUCT],
+                                          update_fields=[S.IS_STALE])
+
+
+def build(everything=False, size=None, batch_size=500):
+    """
+        Rescore stale products (every product when everything is set) and the neighbours they may enter
+        or leave, returns the number of rewritten rows
+    """
+    from .models import ProductSimilarity
+
+    size = size or config.SIMILAR_PRODUCTS_COUNT
+    features = Features()
+    stored = {
+        pk: (similar, scores, is_stale)
+        for pk, similar, scores, is_stale in ProductSimilarity.objects.values_list(
+            S.PRODUCT, S.SIMILAR, S.SCORES, S.IS_STALE).iterator(chunk_size=2000)
+    }
+    if everything:
+        changed = set(features.products)
+    else:
+        changed = {pk for pk, (_, _, is_stale) in stored.items() if is_stale and pk in features.products}
+
+    results = {}
+    affected = set()
+    for pk in changed:
+        scores = features.scores(pk)
+        results[pk] = top(scores, size)
+        for other, score in scores.items():
+            similar, other_scores, _ = stored.get(other, ([], [], False))
+            if len(similar) < size or score > other_scores[-1]:
+                affected.add(other)
+    for pk, (similar, _, _) in stored.items():
+        if changed.intersection(similar):
+            affected.add(pk)
+    for pk in (affected & set(features.products)) - changed:
+        results[pk] = top(features.scores(pk), size)
+
+    rows = [
+        ProductSimilarity(product_id=pk, similar=[other for other, _ in ranked],
+                          scores=[score for _, score in ranked], is_stale=False)
+        for pk, ranked in results.items()
+    ]
+    ProductSimilarity.objects.bulk_create(rows, batch_size=batch_size, update_conflicts=True, unique_fields=[S.PRODUCT],
+                                          update_fields=[S.SIMILAR, S.SCORES, S.IS_STALE, S.UPDATE_DT])
+    return len(rows)
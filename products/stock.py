@@ -0,0 +1,73 @@
+"""
+    Product aggregates and in stock facet counts of changed instance stock.
+    Queryset updates hand their deltas to moved(), which also rebuilds documents and bumps the cache.
+    Single instance writes use recalculate(): their loaded stock misses reservations that changed the
+    row since it was read, so a delta computed from it would drift.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from utils.default_string import S
+
+from utils.cache import bump_on_commit
+
+from .cache import invalidate_products, product_namespace
+from .facets import FacetDelta, apply_deltas
+
+
+def lock(products):
+    """
+        Locks the products in id order and reads in_stock before the change in the same query
+    """
+    return dict(products.select_for_update().order_by(S.ID).values_list(S.ID, S.IN_STOCK))
+
+
+def in_stock_changes(products, before):
+    facet_deltas = defaultdict(FacetDelta)
+    for product_id, category_id, in_stock in products.values_list(S.ID, S.CATEGORY, S.IN_STOCK):
+        facet_deltas[category_id].in_stock_count += int(in_stock) - int(before[product_id])
+    return facet_deltas
+
+
+def recalculate(product_ids):
+    """
+        Recompute the aggregates of the products from their instances under the product row locks
+    """
+    from .models import Product
+
+    products = Product.objects.filter(pk__in=set(product_ids) - {None})
+    before = lock(products)
+    if before:
+        products.recalculate_stock()
+        apply_deltas(in_stock_changes(products, before))
+
+
+def moved(deltas):
+    """
+        deltas is {instance id: stock change} already written to the instances.
+        A fixed number of queries whatever the number of products, facets only when in_stock flips.
+    """
+    from .models import Product, ProductDocument, ProductInstance
+
+    per_product = Counter()
+    for pk, product_id in ProductInstance.objects.filter(pk__in=deltas).values_list(S.ID, S.PRODUCT):
+        per_product[product_id] += deltas[pk]
+    per_product = {product_id: delta for product_id, delta in per_product.items() if delta}
+    if not per_product:
+        return
+    products = Product.objects.filter(pk__in=per_product)
+    before = lock(products)
+    products.add_stocks(per_product)
+    facet_deltas = in_stock_changes(products, before)
+    apply_deltas(facet_deltas)
+
+    product_ids = sorted(per_product)
+    # documents are rendered after commit, the instance and product row locks are already released then
+    transaction.on_commit(lambda: ProductDocument.rebuild(product_ids))
+    if any(not delta.is_empty() for delta in facet_deltas.values()):
+        invalidate_products(*product_ids)
+    else:
+        # lists only show in_stock, a flash sale must not flush the whole catalog on every checkout
+        bump_on_commit(*[product_namespace(pk) for pk in product_ids])
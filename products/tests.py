@@ -1,3 +1,502 @@
-from django.test import TestCase
+import io
+import tempfile
+import unittest
 
-# Create your tests here.
+from PIL import Image
+
+from constance import config
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from . import images, similarity, stock
+from .cache import CATALOG
+from .importer import CatalogImporter
+from .models import Category, CategoryFacet, Color, Comment, Material, Product, ProductAlbum, ProductDocument, \
+    ProductInstance, ProductSimilarity, Size
+from .popularity import buffer
+
+from users.models import User
+
+from utils.cache import get_generations
+
+from utils.default_string import S, U
+
+
+@override_settings(VIEW_COUNTER_FLUSH_SECONDS=10 ** 9)
+class ProductViewTestCase (TestCase):
+    """
+        Base of tests that request product details: the views they buffer are never flushed by the
+        background thread and never reach a later test
+    """
+
+    def tearDown(self):
+        buffer.clear()
+        super().tearDown()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class QueryBudgetTestCase (ProductViewTestCase):
+    """
+        Catalog endpoints must run a fixed number of queries whatever the result size.
+        Raise a budget here only together with the serializer change that needs it.
+    """
+    QUERY_BUDGETS = {
+        f"{U.V1_PRODUCT}-list": 1,
+        f"{U.V1_PRODUCT}-detail": 2,
+        f"{U.V1_CATEGORY}-list": 2,
+        f"{U.V1_CATEGORY}-detail": 2,
+        f"{U.V1_CATEGORY}-filters": 3,
+        f"{U.V1_CATEGORY}-products": 2,
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.material = Material.objects.create(name="material")
+        self.color = Color.objects.create(name="color")
+        self.size = Size.objects.create(name="size")
+        # constance stores the default on the first read of a setting, keep that out of the budgets
+        config.CATEGORY_PRICE_HISTOGRAM_BUCKETS
+
+    def create_products(self, count):
+        for index in range(count):
+            product = Product.objects.create(name=f"product {index}", category=self.category,
+                                             price=100 + index, material=self.material)
+            ProductAlbum.objects.create(product=product, file=f"album/{index}.jpg")
+            for number in range(3):
+                ProductInstance.objects.create(product=product, stock=number, color=self.color,
+                                               size=self.size, p_id=f"{product.pk}-{number}")
+
+    def count_queries(self, url_name, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name, kwargs=kwargs or None))
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def assertWithinBudget(self, url_name, grow=None, **kwargs):
+        grow = grow or self.create_products
+        budget = self.QUERY_BUDGETS[url_name]
+        grow(2)
+        small = self.count_queries(url_name, **kwargs)
+        grow(20)
+        large = self.count_queries(url_name, **kwargs)
+        self.assertEqual(small, large, f"{url_name} query count grows with result size")
+        self.assertLessEqual(large, budget, f"{url_name} ran {large} queries, budget is {budget}")
+
+    def test_product_list(self):
+        self.assertWithinBudget(f"{U.V1_PRODUCT}-list")
+
+    def test_product_detail(self):
+        product = Product.objects.create(name="detail", category=self.category, price=1, material=self.material)
+
+        def grow(count):
+            start = product.instances.count()
+            for number in range(start, start + count):
+                ProductAlbum.objects.create(product=product, file=f"album/detail-{number}.jpg")
+                ProductInstance.objects.create(product=product, stock=1, color=self.color, size=self.size,
+                                               p_id=f"detail-{number}")
+
+        self.assertWithinBudget(f"{U.V1_PRODUCT}-detail", grow=grow, pk=product.pk)
+
+    def test_category_list(self):
+        self.assertWithinBudget(f"{U.V1_CATEGORY}-list")
+
+    def test_category_detail(self):
+        self.assertWithinBudget(f"{U.V1_CATEGORY}-detail", pk=self.category.pk)
+
+    def test_category_filters(self):
+        self.assertWithinBudget(f"{U.V1_CATEGORY}-filters", pk=self.category.pk)
+
+    def test_category_products(self):
+        self.assertWithinBudget(f"{U.V1_CATEGORY}-products", pk=self.category.pk)
+
+    def test_product_detail_not_modified(self):
+        self.create_products(1)
+        url = reverse(f"{U.V1_PRODUCT}-detail", kwargs={"pk": Product.objects.get().pk})
+        etag = self.client.get(url)["ETag"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+@override_settings(RESPONSE_CACHE=True)
+class ResponseCacheTestCase (ProductViewTestCase):
+    """
+        Cached catalog responses are dropped by the generation bump of a write
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.product = Product.objects.create(name="product", category=category, price=10,
+                                              material=Material.objects.create(name="material"))
+
+    def test_write_invalidates_cached_detail(self):
+        url = reverse(f"{U.V1_PRODUCT}-detail", kwargs={"pk": self.product.pk})
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).data["price"], 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 20
+            self.product.save()
+        self.assertEqual(self.client.get(url).data["price"], 20)
+
+    @override_settings(ALLOWED_HOSTS=["testserver", "shop.example.com"])
+    def test_hosts_are_cached_apart(self):
+        self.product.image = "products/product.jpg"
+        self.product.save()
+        url = reverse(f"{U.V1_PRODUCT}-list")
+        self.client.get(url)
+        response = self.client.get(url, HTTP_HOST="shop.example.com", secure=True)
+        self.assertTrue(response.data["results"][0][S.IMAGE].startswith("https://shop.example.com/"))
+
+
+class CategoryFacetTestCase (TestCase):
+    """
+        Incremental facets must equal the ones rebuilt from scratch
+    """
+
+    def setUp(self):
+        self.categories = [Category.objects.create(name=f"category {index}", gender=Category.Genders.UNISEX)
+                           for index in range(2)]
+        self.product = Product.objects.create(name="product", category=self.categories[0], price=10,
+                                              material=Material.objects.create(name="material"))
+        color, size = Color.objects.create(name="color"), Size.objects.create(name="size")
+        for number in range(2):
+            ProductInstance.objects.create(product=self.product, stock=1, color=color, size=size, p_id=f"sku-{number}")
+
+    def facets(self):
+        fields = [*CategoryFacet.COUNT_FIELDS, S.PRODUCT_COUNT, S.IN_STOCK_COUNT]
+        return {facet[S.CATEGORY]: facet for facet in CategoryFacet.objects.values(S.CATEGORY, *fields)}
+
+    def test_moved_product_takes_its_instances(self):
+        self.product.refresh_from_db()
+        self.product.category = self.categories[1]
+        self.product.save()
+        incremental = self.facets()
+        CategoryFacet.rebuild()
+        self.assertEqual(incremental, self.facets())
+        self.assertEqual(incremental[self.categories[0].pk][S.COLORS], {})
+
+    def test_instance_saved_after_a_reservation(self):
+        instances = list(ProductInstance.objects.order_by(S.ID))
+        counts = {instance.pk: 1 for instance in instances}
+        update_dt = Product.objects.values_list(S.UPDATE_DT, flat=True).get()
+        ProductInstance.objects.take_stock(counts)
+        stock.moved({pk: -count for pk, count in counts.items()})
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.in_stock), (0, False))
+        # exports and conditional requests follow update_dt, stock only changes must move it
+        self.assertNotEqual(self.product.update_dt, update_dt)
+        # loaded before the reservation, its stock of 1 is stale
+        instances[0].stock = 4
+        instances[0].save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.in_stock), (4, True))
+        category_id = self.categories[0].pk
+        incremental = self.facets()[category_id]
+        CategoryFacet.rebuild()
+        self.assertEqual(incremental, self.facets()[category_id])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ProductSearchTestCase (TestCase):
+    """
+        ?search= on the product list, ranked by relevance, tolerant to typos on Postgres
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name="tops", gender=Category.Genders.UNISEX)
+        material = Material.objects.create(name="cotton")
+        for name in ["linen shirt", "wool coat", "linen trousers"]:
+            Product.objects.create(name=name, category=category, price=10, material=material)
+
+    def search(self, query):
+        response = self.client.get(reverse(f"{U.V1_PRODUCT}-list"), {"search": query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row[S.NAME] for row in response.data["results"]]
+
+    def test_no_hits(self):
+        self.assertEqual(self.search("zzzzqq"), [])
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "typo tolerance needs trigram search")
+    def test_typo(self):
+        self.assertIn("wool coat", self.search("wol coat"))
+
+    def test_ranking(self):
+        names = self.search("linen shirt")
+        self.assertEqual(names[0], "linen shirt")
+        self.assertNotIn("wool coat", names[:2])
+
+
+class ProductViewsTestCase (ProductViewTestCase):
+    """
+        Detail views are buffered in memory and written by a flush
+    """
+
+    def test_views_are_flushed(self):
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        product = Product.objects.create(name="product", category=category, price=10,
+                                         material=Material.objects.create(name="material"))
+        url = reverse(f"{U.V1_PRODUCT}-detail", kwargs={"pk": product.pk})
+        for _ in range(3):
+            APIClient().get(url)
+        product.refresh_from_db()
+        self.assertEqual(product.views, 0)
+        generations = get_generations([CATALOG])
+        with self.captureOnCommitCallbacks(execute=True):
+            buffer.flush()
+        self.assertNotEqual(get_generations([CATALOG]), generations)
+        product.refresh_from_db()
+        self.assertEqual(product.views, 3)
+        self.assertGreater(product.popularity, 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ProductDocumentTestCase (ProductViewTestCase):
+    """
+        Stored documents are served with the same absolute media URLs as the live serializers
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.product = Product.objects.create(name="product", category=self.category, price=10,
+                                              material=Material.objects.create(name="material"),
+                                              image="products/product.jpg")
+        ProductAlbum.objects.create(product=self.product, file="album/product.jpg")
+        ProductDocument.rebuild([self.product.pk])
+
+    def get(self, url_name, **kwargs):
+        response = self.client.get(reverse(url_name, kwargs=kwargs or None))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_same_url_shape(self):
+        stored = self.get(f"{U.V1_PRODUCT}-detail", pk=self.product.pk)
+        card = self.get(f"{U.V1_PRODUCT}-list")["results"][0]
+        ProductDocument.objects.all().delete()
+        live = self.get(f"{U.V1_PRODUCT}-detail", pk=self.product.pk)
+        live_card = self.get(f"{U.V1_CATEGORY}-products", pk=self.category.pk)["results"][0]
+        self.assertTrue(stored[S.IMAGE].startswith("http://testserver/media/"), stored[S.IMAGE])
+        self.assertTrue(stored[S.ALBUM][0][S.FILE].startswith("http://testserver/media/"))
+        self.assertEqual(stored[S.IMAGE], live[S.IMAGE])
+        self.assertEqual(stored[S.ALBUM], live[S.ALBUM])
+        self.assertEqual(stored.get("images"), live.get("images"))
+        self.assertEqual(card, live_card)
+
+
+class CatalogImporterTestCase (TestCase):
+    """
+        Feed rows are upserted by natural key, invalid rows are skipped and reported
+    """
+
+    def run_import(self, entity, records):
+        importer = CatalogImporter(entity)
+        importer.import_batch(records)
+        return importer
+
+    def test_upsert(self):
+        self.run_import(S.CATEGORIES, [{S.NAME: "coats", S.GENDER: "female"}])
+        product = {S.NAME: "coat", S.CATEGORY: "coats", S.MATERIAL: "wool", S.PRICE: "100"}
+        self.run_import(S.PRODUCTS, [product])
+        instance = {S.P_ID: "coat-1", S.CATEGORY: "coats", S.PRODUCT: "coat", S.COLOR: "red", S.SIZE: "m",
+                    S.STOCK: "2"}
+        self.run_import(S.INSTANCES, [instance])
+        importer = self.run_import(S.PRODUCTS, [{**product, S.PRICE: "120"}])
+        self.run_import(S.INSTANCES, [{**instance, S.STOCK: "5"}])
+        self.assertEqual(importer.stats, {"updated": 1, "created": 0})
+        coat = Product.objects.get()
+        self.assertEqual((coat.price, coat.stock, coat.in_stock), (120, 5, True))
+        self.assertEqual(Category.objects.get().gender, Category.Genders.FEMALE)
+        self.assertEqual(ProductInstance.objects.get().p_id, "coat-1")
+
+    def test_invalid_rows_are_skipped(self):
+        importer = self.run_import(S.CATEGORIES, [
+            {S.NAME: "coats", S.GENDER: "female"},
+            {S.NAME: "shirts"},
+            {S.NAME: "hats", S.GENDER: "other"},
+        ])
+        self.assertEqual([position for position, _ in importer.rejected], [2, 3])
+        importer = self.run_import(S.PRODUCTS, [
+            {S.NAME: "coat", S.CATEGORY: "coats", S.MATERIAL: "wool", S.PRICE: "abc"},
+            {S.NAME: "scarf", S.CATEGORY: "scarves", S.MATERIAL: "wool", S.PRICE: "10"},
+            {S.NAME: "jacket", S.CATEGORY: "coats", S.MATERIAL: "wool", S.PRICE: "90"},
+        ])
+        self.assertEqual([position for position, _ in importer.rejected], [1, 2])
+        self.assertEqual(importer.stats["skipped"], 2)
+        self.assertEqual(list(Category.objects.values_list(S.NAME, flat=True)), ["coats"])
+        self.assertEqual(list(Product.objects.values_list(S.NAME, flat=True)), ["jacket"])
+
+
+class ImageVariantsTestCase (TestCase):
+    """
+        build_image_variants derives the images whose variants are missing or stale, and only those
+    """
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        file = io.BytesIO()
+        Image.new("RGB", (800, 600), "red").save(file, "JPEG")
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.product = Product.objects.create(name="product", category=category, price=10,
+                                              material=Material.objects.create(name="material"))
+        self.product.image.save("product.jpg", ContentFile(file.getvalue()))
+
+    def build(self):
+        output = io.StringIO()
+        call_command("build_image_variants", workers=1, stdout=output)
+        return output.getvalue()
+
+    def test_build_variants(self):
+        self.assertIn("Product: 1 built", self.build())
+        self.product.refresh_from_db()
+        self.assertTrue(images.is_current(self.product.image.name, self.product.image_variants))
+        self.assertTrue(default_storage.exists(self.product.image_variants["thumbnail"]))
+        self.assertNotIn("Product: 1 built", self.build())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ProductRatingTestCase (TestCase):
+    """
+        Comment writes keep the denormalized rating of their product in step with recalculate_rating
+    """
+
+    def setUp(self):
+        self.category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.material = Material.objects.create(name="material")
+        self.product = self.create_product("product")
+        self.users = [
+            User.objects.create(username=f"user{index}", email=f"user{index}@example.com",
+                                phone_number=f"+1415555010{index}", first_name="user", last_name="user")
+            for index in range(2)
+        ]
+
+    def create_product(self, name):
+        return Product.objects.create(name=name, category=self.category, price=10, material=self.material)
+
+    def assertRating(self, product, total, count, rate):
+        product.refresh_from_db()
+        self.assertEqual((product.rate_total, product.rate_count), (total, count))
+        self.assertAlmostEqual(product.rate, rate)
+        expected = (product.rate_total, product.rate_count, product.rate)
+        Product.objects.filter(pk=product.pk).recalculate_rating()
+        product.refresh_from_db()
+        self.assertEqual((product.rate_total, product.rate_count, product.rate), expected)
+
+    def test_comment_lifecycle(self):
+        first = Comment.objects.create(product=self.product, user=self.users[0], rating=5)
+        Comment.objects.create(product=self.product, user=self.users[1], rating=2)
+        self.assertRating(self.product, 7, 2, 3.5)
+        first.rating = 3
+        first.save()
+        self.assertRating(self.product, 5, 2, 2.5)
+        first.is_active = False
+        first.save()
+        self.assertRating(self.product, 2, 1, 2.0)
+        first.is_active = True
+        first.save()
+        self.assertRating(self.product, 5, 2, 2.5)
+        first.delete()
+        self.assertRating(self.product, 2, 1, 2.0)
+
+    def test_refreshed_comment(self):
+        comment = Comment.objects.create(product=self.product, user=self.users[0], rating=5)
+        other = Comment.objects.get(pk=comment.pk)
+        other.rating = 1
+        other.save()
+        comment.refresh_from_db()
+        comment.rating = 3
+        comment.save()
+        self.assertRating(self.product, 3, 1, 3.0)
+        comment.refresh_from_db(fields=[S.IS_ACTIVE])
+        comment.rating = 4
+        comment.save()
+        self.assertRating(self.product, 4, 1, 4.0)
+
+    def test_comment_moved_to_another_product(self):
+        other = self.create_product("other")
+        comment = Comment.objects.create(product=self.product, user=self.users[0], rating=4)
+        comment.product = other
+        comment.save()
+        self.assertRating(self.product, 0, 0, 0.0)
+        self.assertRating(other, 4, 1, 4.0)
+
+    def test_duplicate_review(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = reverse(f"{U.V1_PRODUCT}-comments", kwargs={"pk": self.product.pk})
+        self.assertEqual(client.post(url, {S.RATING: 4}).status_code, 201)
+        response = client.post(url, {S.RATING: 1})
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertRating(self.product, 4, 1, 4.0)
+
+
+class SimilarProductsTestCase (TestCase):
+    """
+        Incremental builds rescore stale products and their neighbours like a full rebuild
+    """
+
+    def setUp(self):
+        self.category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        self.other_category = Category.objects.create(name="other", gender=Category.Genders.UNISEX)
+        self.material = Material.objects.create(name="material")
+
+    def create_product(self, name, price, category=None):
+        return Product.objects.create(name=name, category=category or self.category, price=price,
+                                      material=self.material)
+
+    def similar(self):
+        return dict(ProductSimilarity.objects.values_list(S.PRODUCT, S.SIMILAR))
+
+    def test_build(self):
+        first, second = self.create_product("first", 100), self.create_product("second", 110)
+        far = self.create_product("far", 1000)
+        similarity.build()
+        self.assertEqual(self.similar()[first.pk], [second.pk, far.pk])
+        self.assertEqual(ProductSimilarity.objects.filter(is_stale=True).count(), 0)
+        closest = self.create_product("closest", 100)
+        far.category = self.other_category
+        far.save()
+        similarity.build()
+        incremental = self.similar()
+        similarity.build(everything=True)
+        self.assertEqual(incremental, self.similar())
+        self.assertEqual(incremental[first.pk][0], closest.pk)
+        self.assertEqual(incremental[far.pk], [second.pk, first.pk, closest.pk])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class ProductBulkTestCase (TestCase):
+    """
+        Bulk details keep the requested order and list the ids that do not exist
+    """
+
+    def test_missing_ids(self):
+        category = Category.objects.create(name="category", gender=Category.Genders.UNISEX)
+        material = Material.objects.create(name="material")
+        first, second = [
+            Product.objects.create(name=name, category=category, price=10, material=material)
+            for name in ["first", "second"]
+        ]
+        ProductDocument.rebuild([first.pk])
+        missing = second.pk + 1
+        url = reverse(f"{U.V1_PRODUCT}-bulk")
+        response = APIClient().get(url, {"ids": f"{second.pk},{missing},{first.pk},{second.pk}"})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([product[S.ID] for product in response.data["results"]], [second.pk, first.pk])
+        self.assertEqual(response.data["missing"], [missing])
+        self.assertEqual(APIClient().get(url, {"ids": "1,x"}).status_code, 400)
@@ -8,6 +8,7 @@ from utils.default_string import U, T
 router = routers.DefaultRouter()
 router.register("categories", views.CategoryViewSet, basename=U.V1_CATEGORY)
 router.register("products", views.ProductViewSet, basename=U.V1_PRODUCT)
+router.register("skus", views.SkuViewSet, basename=U.V1_SKU)
 
 urlpatterns = [
     path("", include(router.urls))
@@ -1,20 +1,30 @@
 from django.utils.decorators import method_decorator
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from rest_framework import viewsets, mixins, status
+from rest_framework import exceptions, viewsets, mixins, status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
+from django.db.models import Count, Max
+from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Category, Product, ProductInstance
+from .models import Category, Comment, Product, ProductDocument, ProductInstance, ProductSimilarity
 from .filters import ProductFilter
-from .serializers import ProductSerializer, CategorySerializer, ProductDetailSerializer
+from .pagination import CommentPagination, ProductPagination
+from .popularity import record_view
+from .search import get_search_backend
+from .cache import ATTRIBUTES, CATALOG, product_namespace
+from .serializers import ProductSerializer, CategorySerializer, ProductDetailSerializer, CategoryFilterSerializer, \
+    CategorySummarySerializer, ProductCardSerializer, CommentSerializer, SkuLookupSerializer, SkuSerializer, \
+    absolute_media
     
 from utils.default_string import T, S
-from utils.views import RetrieveMixin #, PostMixin, DestroyMixin
+from utils.views import PostMixin, RetrieveMixin, StreamingListMixin, cached_response, conditional_get #, DestroyMixin
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet, RetrieveMixin):
+class CategoryViewSet(StreamingListMixin, viewsets.ReadOnlyModelViewSet, RetrieveMixin):
     """
         Get All Categories
     """
@@ -22,17 +32,63 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet, RetrieveMixin):
     permission_classes = [AllowAny]
 
     serializer_class = CategorySerializer
+    pagination_class = ProductPagination
+    stream_chunk_size = 20
+
+    @property
+    def paginator(self):
+        if self.action != 'products':
+            return None
+        return super().paginator
+
+    @property
+    def full_list(self):
+        return self.action == 'list' and self.request.query_params.get("full") in ["1", "true"]
+
+    def wants_stream(self):
+        return self.full_list or super().wants_stream()
+
+    def get_serializer_class(self):
+        if self.action == 'filters':
+            return CategoryFilterSerializer
+        if self.action == 'products':
+            return ProductCardSerializer
+        if self.action == 'list' and not self.full_list:
+            return CategorySummarySerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
+        if self.action == 'list' and not self.full_list:
+            return Category.objects.with_preview(CategorySummarySerializer.PREVIEW_SIZE)
+        if self.action in ['list', 'retrieve']:
+            return Category.objects.with_products()
+        if self.action == 'filters':
+            return Category.objects.select_related(S.FACET)
         return super().get_queryset()
     
     def get_filterset_class(self):
         return ProductFilter
+
+    def get_cache_namespaces(self):
+        return [CATALOG]
+
+    def get_validators(self):
+        if self.action != 'filters':
+            return None
+        dates = Category.objects.filter(pk=self.kwargs[self.lookup_field]).aggregate(
+            category=Max(S.UPDATE_DT), facet=Max(f"{S.FACET}__{S.UPDATE_DT}"))
+        if dates["category"] is None:
+            return None
+        last_modified = max(date for date in dates.values() if date is not None)
+        return last_modified, (dates["category"], dates["facet"])
     
     @swagger_auto_schema(
         operation_summary="Get All Categories",
+        manual_parameters=[openapi.Parameter("full", openapi.IN_QUERY, "Stream every category with all of its products",
+                                             type=openapi.TYPE_BOOLEAN)],
         tags=[T.CATEGORY_TAG]
     )
+    @cached_response
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
@@ -40,6 +96,7 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet, RetrieveMixin):
         operation_summary="Get Details of one category",
         tags=[T.CATEGORY_TAG]
     )
+    @cached_response
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
     
@@ -48,6 +105,8 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet, RetrieveMixin):
         tags=[T.CATEGORY_TAG]
     )
     @action(detail=True, methods=['get'])
+    @conditional_get
+    @cached_response
     def filters(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
@@ -56,35 +115,131 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet, RetrieveMixin):
         tags=[T.CATEGORY_TAG]
     )
     @action(detail=True, methods=['get'])
+    @cached_response
     def products(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        category = self.get_object()
+        queryset = Product.objects.for_cards().filter(category=category)
+        queryset = ProductFilter(request.query_params, queryset=queryset, request=request).qs
+        if self.wants_stream():
+            return self.stream_list(queryset)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(StreamingListMixin, PostMixin, viewsets.ReadOnlyModelViewSet):
+    MAX_BULK_IDS = 200
+
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
+    pagination_class = ProductPagination
     permission_classes = [AllowAny]
-    
+
+    @property
+    def search_query(self):
+        return self.request.query_params.get("search")
+
+    @property
+    def paginator(self):
+        if self.action == 'comments' and not hasattr(self, '_paginator'):
+            self._paginator = CommentPagination()
+        return super().paginator
+
+    @property
+    def keyset_orderings(self):
+        if self.action == 'comments':
+            return CommentPagination.orderings
+        if self.search_query:
+            return ProductPagination.search_orderings
+        return ProductPagination.orderings
+
+    def get_default_keyset_ordering(self):
+        if self.action == 'comments':
+            return CommentPagination.default_ordering
+        if self.search_query:
+            return "relevance"
+        return ProductPagination.default_ordering
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action == 'retrieve':
+            # counted before the 304 and cache shortcuts, those are views too
+            record_view(kwargs.get(self.lookup_field))
+
+    def get_bulk_ids(self):
+        """
+            Distinct ids of ?ids=1,2,3 in the requested order
+        """
+        try:
+            ids = [int(pk) for pk in self.request.query_params.get("ids", "").split(",") if pk.strip()]
+        except ValueError:
+            raise exceptions.ValidationError({"ids": "comma separated product ids"})
+        ids = list(dict.fromkeys(ids))
+        if not ids or len(ids) > self.MAX_BULK_IDS:
+            raise exceptions.ValidationError({"ids": f"between 1 and {self.MAX_BULK_IDS} product ids"})
+        return ids
+
+    def get_cache_namespaces(self):
+        if self.action == 'retrieve':
+            return [product_namespace(self.kwargs[self.lookup_field]), ATTRIBUTES]
+        if self.action == 'bulk':
+            return [*[product_namespace(pk) for pk in self.get_bulk_ids()], ATTRIBUTES]
+        if self.action in ['list', 'similar']:
+            return [CATALOG]
+        return None
+
+    def get_validators(self):
+        """
+            The stored document is rebuilt with every change, otherwise the newest update_dt of the
+            rows ProductDetailSerializer reads, counts catch deleted children
+        """
+        if self.action != 'retrieve':
+            return None
+        document_dt = ProductDocument.objects.filter(product_id=self.kwargs[self.lookup_field]).values_list(
+            S.UPDATE_DT, flat=True).first()
+        if document_dt is not None:
+            return document_dt, (document_dt,)
+        dates = Product.objects.filter(pk=self.kwargs[self.lookup_field]).aggregate(
+            product_dt=Max(S.UPDATE_DT),
+            material_dt=Max(f"{S.MATERIAL}__{S.UPDATE_DT}"),
+            instance_dt=Max(f"{S.INSTANCES}__{S.UPDATE_DT}"),
+            album_dt=Max(f"{S.ALBUM}__{S.UPDATE_DT}"),
+            instance_count=Count(S.INSTANCES, distinct=True),
+            album_count=Count(S.ALBUM, distinct=True),
+        )
+        if dates["product_dt"] is None:
+            return None
+        last_modified = max(date for key, date in dates.items() if key.endswith("_dt") and date)
+        return last_modified, tuple(dates.values())
 
     def get_serializer_class(self):
         if self.action == 'list':
-            return ProductSerializer
-        if self.action == 'retrieve':
-            return ProductDetailSerializer 
-        if self.action == 'search':
-            return ProductSerializer
-        
+            return ProductCardSerializer
+        if self.action in ['retrieve', 'bulk']:
+            return ProductDetailSerializer
+        if self.action == 'similar':
+            return ProductCardSerializer
+        if self.action == 'comments':
+            return CommentSerializer
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        query = self.request.query_params.get("search")
-        if query is not None:
-            return Product.objects.filter(name__icontains=query)
-        return super().get_queryset()
+        if self.action in ['retrieve', 'bulk']:
+            queryset = Product.objects.for_detail()
+        else:
+            queryset = Product.objects.for_cards()
+        if self.search_query:
+            return get_search_backend().search(queryset, self.search_query)
+        return queryset
     
     @swagger_auto_schema(
         operation_summary="Get all Products List",
+        manual_parameters=[openapi.Parameter("search", openapi.IN_QUERY, "Ranked keyword search", type=openapi.TYPE_STRING)],
         tags=[T.PRODUCT_TAG]
     )
+    @cached_response
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
@@ -92,12 +247,94 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         operation_summary="Get Specific Product Detail",
         tags=[T.PRODUCT_TAG]
     )
+    @conditional_get
+    @cached_response
     def retrieve(self, request, *args, **kwargs):
+        detail = ProductDocument.objects.filter(product_id=kwargs[self.lookup_field]).values_list(
+            S.DETAIL, flat=True).first()
+        if detail is not None:
+            return Response(absolute_media(detail, request))
         return super().retrieve(request, *args, **kwargs)
-    
+
+    @swagger_auto_schema(
+        operation_summary="Get details of many products in the requested order",
+        manual_parameters=[openapi.Parameter("ids", openapi.IN_QUERY, "Comma separated product ids",
+                                             type=openapi.TYPE_STRING, required=True)],
+        tags=[T.PRODUCT_TAG]
+    )
+    @action(detail=False, methods=['get'])
+    @cached_response
+    def bulk(self, request, *args, **kwargs):
+        ids = self.get_bulk_ids()
+        details = {
+            pk: absolute_media(detail, request)
+            for pk, detail in ProductDocument.objects.filter(product_id__in=ids).values_list(S.PRODUCT, S.DETAIL)
+        }
+        pending = [pk for pk in ids if pk not in details]
+        if pending:
+            for product in self.get_queryset().filter(pk__in=pending):
+                details[product.pk] = self.get_serializer(product).data
+        return Response({
+            "results": [details[pk] for pk in ids if pk in details],
+            "missing": [pk for pk in ids if pk not in details],
+        })
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary="Get newest reviews of one product",
+        tags=[T.PRODUCT_TAG]
+    )
+    @swagger_auto_schema(
+        method='post',
+        operation_summary="Review one product",
+        tags=[T.PRODUCT_TAG]
+    )
+    @action(detail=True, methods=['get', 'post'], permission_classes=[IsAuthenticatedOrReadOnly])
+    def comments(self, request, *args, **kwargs):
+        product = get_object_or_404(Product.objects.only(S.ID), pk=kwargs[self.lookup_field])
+        if request.method == 'POST':
+            context = {**self.get_serializer_context(), S.PRODUCT: product}
+            return self.custom_create(request, status.HTTP_201_CREATED, context=context)
+        queryset = Comment.objects.filter(product=product, is_active=True).select_related(S.USER)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @swagger_auto_schema(
+        operation_summary="Get products similar to one product, most similar first",
+        tags=[T.PRODUCT_TAG]
+    )
+    @action(detail=True, methods=['get'])
+    @cached_response
+    def similar(self, request, *args, **kwargs):
+        similar = ProductSimilarity.objects.filter(product_id=kwargs[self.lookup_field]).values_list(
+            S.SIMILAR, flat=True).first() or []
+        products = Product.objects.for_cards().in_bulk(similar)
+        serializer = self.get_serializer([products[pk] for pk in similar if pk in products], many=True)
+        return Response(serializer.data)
+
+
+class SkuViewSet(viewsets.GenericViewSet):
+    """
+        Batch SKU resolution for the POS and warehouse integrations
+    """
+    serializer_class = SkuLookupSerializer
+    permission_classes = [IsAdminUser]
+
     @swagger_auto_schema(
-        operation_summary="Search by Keyword",
+        operation_summary="Resolve a batch of SKUs to their variant, product, price and stock",
+        request_body=SkuLookupSerializer,
+        responses={200: SkuSerializer(many=True)},
         tags=[T.PRODUCT_TAG]
     )
-    def serach(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
\ No newline at end of file
+    @action(detail=False, methods=['post'])
+    def lookup(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        p_ids = list(dict.fromkeys(serializer.validated_data["p_ids"]))
+        instances = ProductInstance.objects.filter(p_id__in=p_ids).select_related(S.PRODUCT, S.COLOR, S.SIZE)
+        found = {instance.p_id: instance for instance in instances}
+        return Response({
+            "results": SkuSerializer([found[p_id] for p_id in p_ids if p_id in found], many=True).data,
+            "missing": [p_id for p_id in p_ids if p_id not in found],
+        })
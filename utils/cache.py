@@ -0,0 +1,60 @@
+"""
+    Response cache keyed by generation counters.
+    Writers bump the counters of what they changed, readers build keys from the current counters,
+    so stale entries are never read again and simply expire.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def generation_key(namespace):
+    return f"generation:{namespace}"
+
+
+def get_generations(namespaces):
+    """
+        Current counter of every namespace, missing counters start from the clock so an evicted
+        counter never comes back to a number that is still in use
+    """
+    keys = [generation_key(namespace) for namespace in namespaces]
+    generations = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def bump(*namespaces):
+    for namespace in namespaces:
+        try:
+            cache.incr(generation_key(namespace))
+        except ValueError:
+            cache.set(generation_key(namespace), time.time_ns(), timeout=None)
+
+
+def bump_on_commit(*namespaces):
+    """
+        Bump after commit, a reader between the write and the commit would cache old rows otherwise
+    """
+    transaction.on_commit(lambda: bump(*namespaces))
+
+
+def response_key(request, namespaces):
+    """
+        Bodies hold absolute URLs, so scheme and host are part of the key
+    """
+    query = sorted(request.query_params.lists())
+    generations = get_generations(namespaces)
+    origin = (request.scheme, request.get_host())
+    digest = hashlib.md5(repr((origin, request.path, query, generations)).encode()).hexdigest()
+    return f"response:{digest}"
+
+
+def get_timeout():
+    return getattr(settings, "RESPONSE_CACHE_TIMEOUT", 3600)
@@ -14,6 +14,10 @@ class D:
     PRODUCT_INSTANCES = "product_instances"
     SIZE = "size"
     ALBUM = "album"
+    CATEGORY_FACET = "category_facet"
+    PRODUCT_DOCUMENT = "product_document"
+    COMMENT = "comment"
+    PRODUCT_SIMILARITY = "product_similarity"
 
     """
         User app
@@ -31,4 +35,11 @@ class D:
         Order App
     """
     ORDER = "order"
-    ORDER_ITEM = "order_item"
\ No newline at end of file
+    ORDER_ITEM = "order_item"
+    RESERVATION = "reservation"
+    ORDER_NUMBER_COUNTER = "order_number_counter"
+
+    """
+        Utils App
+    """
+    IDEMPOTENCY_KEY = "idempotency_key"
@@ -29,6 +29,34 @@ class S(D):
     FILE = "file"
     STOCK = "stock"
     P_ID = "p_id"
+    PRODUCTS = "products"
+    INSTANCES = "instances"
+    SEARCH_DOCUMENT = "search_document"
+    SEARCH_RANK = "search_rank"
+    SIZES = "sizes"
+    PRICES = "prices"
+    PRODUCT_COUNT = "product_count"
+    IN_STOCK_COUNT = "in_stock_count"
+    PRICE_RANGE = "price_range"
+    FACET = "facet"
+    PREVIEW_PRODUCTS = "preview_products"
+    IN_STOCK = "in_stock"
+    CATEGORIES = "categories"
+    ALBUMS = "albums"
+    DOCUMENT = "document"
+    DETAIL = "detail"
+    CARD = "card"
+    PK = "pk"
+    RATING = "rating"
+    RATE_TOTAL = "rate_total"
+    RATE_COUNT = "rate_count"
+    TEXT = "text"
+    COMMENTS = "comments"
+    SIMILAR = "similar"
+    SCORES = "scores"
+    IS_STALE = "is_stale"
+    VIEWS = "views"
+    POPULARITY = "popularity"
     
     """
         Users App
@@ -80,8 +108,17 @@ class S(D):
     ORDER_STATUS = "order_status"
     SHIPPING_ADDRESS = "shipping_address"
     PAYMENT_STATUS = "payment_status"
+    RESERVATION_STATUS = "reservation_status"
+    RESERVATIONS = "reservations"
+    VALUE = "value"
+    REFERENCE = "reference"
+    PAYMENT = "payment"
+    URL = "url"
+    STATUS = "status"
 
     """
         Views
     """
     CONTEXT = "context"
+    TIMINGS = "timings"
+    SCOPE = "scope"
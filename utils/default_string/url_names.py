@@ -4,8 +4,14 @@ class U:
     """
     V1_CATEGORY = "V1_CATEGORY"
     V1_PRODUCT = "V1_PRODUCT"
+    V1_SKU = "V1_SKU"
     V1_HOMEPAGE = "V1_HOMEPAGE"
     V1_CART = "V1_CART"
+    V1_ORDER = "V1_ORDER"
+    V1_PAYMENT = "V1_PAYMENT"
+    V1_PAYMENT_START = "V1_PAYMENT_START"
+    V1_PAYMENT_CALLBACK = "V1_PAYMENT_CALLBACK"
+    V1_EXPORT = "V1_EXPORT"
     V1_USER = "V1_USER"
 
 
@@ -22,5 +28,7 @@ class T:
 
 
     CART_TAG = "Cart"
+    ORDER_TAG = "Order"
+    EXPORT_TAG = "Export"
 
     USER_TAG = "User"
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+    Constant memory CSV/JSONL export of catalog and order tables
+"""
+
+import csv
+import io
+import json
+import zlib
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .default_string import S
+
+
+DATASETS = {
+    "products": ("products.Product", [
+        S.ID, S.NAME, "category_id", "category__name", "material__name", S.PRICE, S.RATE, S.STOCK, S.IN_STOCK,
+        S.DESCRIPTION, S.IMAGE, S.IS_ACTIVE, S.INSERT_DT, S.UPDATE_DT,
+    ]),
+    "product_instances": ("products.ProductInstance", [
+        S.ID, S.P_ID, "product_id", "product__name", "color__name", "size__name", S.STOCK, S.IS_ACTIVE,
+        S.INSERT_DT, S.UPDATE_DT,
+    ]),
+    "orders": ("orders.Order", [
+        S.ID, S.NUMBER, "user_id", S.ORDER_STATUS, S.TOTAL_AMOUNT, "shipping_address_id", S.INSERT_DT, S.UPDATE_DT,
+    ]),
+    "order_items": ("orders.OrderItem", [
+        S.ID, "order_id", "order__number", "product_id", "product__p_id", S.COUNT, S.TOTAL_AMOUNT,
+        S.INSERT_DT, S.UPDATE_DT,
+    ]),
+}
+
+FORMATS = ("csv", "jsonl")
+
+
+class Export:
+    """
+        One dataset read through a server side cursor and written line by line
+    """
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, dataset, format="csv", since=None, chunk_size=2000):
+        self.model_name, self.fields = DATASETS[dataset]
+        self.format = format
+        self.since = since
+        self.chunk_size = chunk_size
+
+    def get_queryset(self):
+        # every exported model indexes update_dt, incremental exports do not scan the table
+        queryset = apps.get_model(self.model_name).objects.order_by(S.ID)
+        if self.since is not None:
+            queryset = queryset.filter(update_dt__gte=self.since)
+        return queryset.values_list(*self.fields)
+
+    def rows(self):
+        return self.get_queryset().iterator(chunk_size=self.chunk_size)
+
+    def lines(self):
+        if self.format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(self.fields)
+            for row in self.rows():
+                writer.writerow(row)
+                if buffer.tell() >= self.BUFFER_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for row in self.rows():
+                yield json.dumps(dict(zip(self.fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + "\n"
+
+    def chunks(self, compress=False):
+        """
+            Encoded output in blocks of about BUFFER_SIZE bytes, gzip framed when compress is set
+        """
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        pending, size = [], 0
+        for line in self.lines():
+            pending.append(line.encode())
+            size += len(pending[-1])
+            if size >= self.BUFFER_SIZE:
+                data = b"".join(pending)
+                pending, size = [], 0
+                data = compressor.compress(data) if compressor else data
+                if data:
+                    yield data
+        data = b"".join(pending)
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
@@ -0,0 +1,117 @@
+"""
+    Idempotency-Key support for PostMixin.custom_create.
+    The key row is inserted in the same transaction as the write it guards. A concurrent duplicate
+    blocks on the unique index until the first request commits, then replays its stored response,
+    or runs itself when the first one failed and rolled back. Only successful responses are stored,
+    a request that raised can be retried with the same key.
+"""
+
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions, status
+from rest_framework.response import Response
+
+from .default_string import S
+from .server_utils import idempotency_expire_dt_generator
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyReused(exceptions.APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = _("Idempotency-Key was already used for a different request")
+    default_code = "idempotency_key_reused"
+
+
+def get_scope(request):
+    """
+        Keys are unique per user, or per session for anonymous users, and per endpoint
+    """
+    if request.user.is_authenticated:
+        owner = f"{S.USER}:{request.user.pk}"
+    elif request.session.session_key:
+        owner = f"{S.SESSION}:{request.session.session_key}"
+    else:
+        return None
+    return f"{owner}:{request.method}:{request.path}"[:255]
+
+
+def get_fingerprint(request):
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim(scope, key, fingerprint):
+    """
+        None when this request owns the key, the stored row of an earlier request otherwise
+    """
+    from .models import IdempotencyKey
+
+    while True:
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(scope=scope, key=key, fingerprint=fingerprint,
+                                              expire_dt=idempotency_expire_dt_generator())
+            return None
+        except IntegrityError:
+            pass
+        stored = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if stored is None:
+            continue
+        if stored.expire_dt <= timezone.now():
+            stored.delete()
+            continue
+        return stored
+
+
+def replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(stored.response, status=stored.status_code, headers={REPLAYED_HEADER: "true"})
+
+
+def run(request, write):
+    """
+        Response of write(), or the stored response of an earlier request with the same key
+    """
+    from .models import IdempotencyKey
+
+    key = request.headers.get(HEADER)
+    scope = key and get_scope(request)
+    if not scope:
+        return write()
+    if len(key) > MAX_KEY_LENGTH:
+        raise exceptions.ValidationError({HEADER: _("Ensure this header has no more than 255 characters")})
+    fingerprint = get_fingerprint(request)
+    with transaction.atomic():
+        stored = claim(scope, key, fingerprint)
+        if stored is not None:
+            return replay(stored, fingerprint)
+        response = write()
+        IdempotencyKey.objects.filter(scope=scope, key=key).update(
+            status_code=response.status_code, response=response.data, update_dt=timezone.now())
+    return response
+
+
+def delete_expired(batch_size=1000, now=None):
+    """
+        Delete expired keys batch by batch, returns the number of deleted rows
+    """
+    from .models import IdempotencyKey
+
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expire_dt__lte=now).values_list(S.ID, flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
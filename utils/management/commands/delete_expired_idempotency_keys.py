@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from utils.idempotency import delete_expired
+
+
+class Command(BaseCommand):
+    help = "Delete stored idempotent responses past their TTL, run it every hour or so"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = delete_expired(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"deleted {count} idempotency keys"))
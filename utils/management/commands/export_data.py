@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from utils.export import DATASETS, FORMATS, Export
+
+
+class Command(BaseCommand):
+    help = "Export a catalog or order table as CSV/JSONL with constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", choices=DATASETS)
+        parser.add_argument("path", help="Output file, compressed when it ends with .gz")
+        parser.add_argument("--format", choices=FORMATS, default="csv")
+        parser.add_argument("--since", help="Only rows with update_dt at or after this ISO datetime")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since must be an ISO datetime")
+        export = Export(options["dataset"], format=options["format"], since=since, chunk_size=options["chunk_size"])
+        written = 0
+        with open(options["path"], "wb") as file:
+            for chunk in export.chunks(compress=options["path"].endswith(".gz")):
+                file.write(chunk)
+                written += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f"exported {options['dataset']} to {options['path']} ({written} bytes)"))
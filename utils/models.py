@@ -1,3 +1,67 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django_autoutils.model_utils import AbstractModel
+from django.utils.translation import gettext_lazy as _
 
-# Create your models here.
+from .default_string import D, S
+
+
+class TrackFieldsMixin:
+    """
+        Remember TRACKED_FIELDS as they were last loaded from or written to the database
+    """
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self, fields=None):
+        values = {
+            name: self.__dict__.get(self._meta.get_field(name).attname) for name in self.TRACKED_FIELDS
+            if fields is None or name in fields or self._meta.get_field(name).attname in fields
+        }
+        self._loaded_values = values if fields is None else {**(self.loaded_values or {}), **values}
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self.remember_loaded_values(fields if self.loaded_values is not None else None)
+
+    @property
+    def loaded_values(self):
+        """
+            None when the row was never loaded or saved
+        """
+        return getattr(self, "_loaded_values", None)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_loaded_values()
+
+
+class IdempotencyKey (AbstractModel):
+    """
+        Response of a mutating request, replayed to retries that send the same Idempotency-Key
+    """
+    scope = models.CharField(_("scope"), max_length=255)
+    key = models.CharField(_("key"), max_length=255)
+    fingerprint = models.CharField(_("fingerprint"), max_length=64)
+    status_code = models.PositiveSmallIntegerField(_("status_code"), null=True, blank=True)
+    response = models.JSONField(_("response"), null=True, blank=True, encoder=DjangoJSONEncoder)
+    expire_dt = models.DateTimeField(_("expire_dt"))
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+    class Meta:
+        db_table = D.IDEMPOTENCY_KEY
+        verbose_name = _("idempotency key")
+        verbose_name_plural = _("idempotency keys")
+        indexes = [
+            models.Index(name="idempotency_expire_dt_idx", fields=[S.EXPIRE_DT]),
+        ]
+        constraints = [
+            models.UniqueConstraint(name="idempotency_scope_key_unique", fields=[S.SCOPE, S.KEY]),
+        ]
@@ -0,0 +1,148 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .default_string import S
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+        DjangoJSONEncoder cuts datetimes to milliseconds, a cursor has to keep the exact sort key
+        or rows sharing its millisecond are skipped
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+        Cursor pagination on a (sort key, id) pair.
+        Every page is one index range scan, so page N costs the same as page 1
+        and rows inserted while paging never shift the following pages.
+    """
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    ordering_query_param = "ordering"
+
+    orderings = {
+        "newest": (f"-{S.INSERT_DT}", f"-{S.ID}"),
+    }
+    default_ordering = "newest"
+
+    invalid_cursor_message = _("Invalid cursor")
+
+    def get_orderings(self, view):
+        return getattr(view, "keyset_orderings", self.orderings)
+
+    def get_ordering_name(self, request, view):
+        orderings = self.get_orderings(view)
+        name = request.query_params.get(self.ordering_query_param)
+        if name in orderings:
+            return name
+        get_default = getattr(view, "get_default_keyset_ordering", None)
+        if get_default is not None:
+            return get_default()
+        return getattr(view, "default_keyset_ordering", self.default_ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, ordering_name, values):
+        data = json.dumps([ordering_name, *values], cls=CursorEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request, queryset, ordering_name, keys):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            name, *values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if name != ordering_name or len(values) != len(keys):
+            raise NotFound(self.invalid_cursor_message)
+        return [self.to_python(queryset, key, value) for key, value in zip(keys, values)]
+
+    @staticmethod
+    def to_python(queryset, key, value):
+        try:
+            return queryset.model._meta.get_field(key.lstrip("-")).to_python(value)
+        except FieldDoesNotExist:
+            return value
+
+    @staticmethod
+    def after(keys, values):
+        """
+            Rows strictly after `values` in `keys` order
+        """
+        condition = Q()
+        equal = {}
+        for key, value in zip(keys, values):
+            name = key.lstrip("-")
+            lookup = "lt" if key.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering_name = self.get_ordering_name(request, view)
+        keys = self.get_orderings(view)[self.ordering_name]
+        page_size = self.get_page_size(request)
+
+        values = self.decode_cursor(request, queryset, self.ordering_name, keys)
+        queryset = queryset.order_by(*keys)
+        if values is not None:
+            queryset = queryset.filter(self.after(keys, values))
+
+        rows = list(queryset[:page_size + 1])
+        self.next_values = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            self.next_values = [getattr(last, key.lstrip("-")) for key in keys]
+        return rows
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.ordering_query_param, self.ordering_name)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.ordering_name, self.next_values))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -30,3 +30,17 @@ def token_generator():
         Generate a token for user authorization by configurable size
     """
     return id_generator(size=config.USER_TOKEN_LENGTH)
+
+
+def reservation_expire_dt_generator():
+    """
+        Generate expire date time of checkout stock reservations
+    """
+    return timezone.now()+timezone.timedelta(minutes=config.RESERVATION_TTL_MINUTE)
+
+
+def idempotency_expire_dt_generator():
+    """
+        Generate expire date time of stored idempotent responses
+    """
+    return timezone.now()+timezone.timedelta(hours=config.IDEMPOTENCY_KEY_TTL_HOUR)
@@ -0,0 +1,41 @@
+from django.http import StreamingHttpResponse
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def serialized_chunks(queryset, serializer_class, context=None, chunk_size=500):
+    """
+        Serialize queryset rows chunk by chunk, only one chunk is held in memory
+    """
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield serializer_class(chunk, many=True, context=context).data
+            chunk = []
+    if chunk:
+        yield serializer_class(chunk, many=True, context=context).data
+
+
+def json_array(chunks):
+    """
+        Encode chunks of dicts as one JSON array, piece by piece
+    """
+    encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    yield "["
+    separator = ""
+    for chunk in chunks:
+        if chunk:
+            yield separator + ",".join(encoder.encode(item) for item in chunk)
+            separator = ","
+    yield "]"
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+        JSON array response written incrementally from a queryset
+    """
+
+    def __init__(self, queryset, serializer_class, context=None, chunk_size=500, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(json_array(serialized_chunks(queryset, serializer_class, context, chunk_size)), **kwargs)
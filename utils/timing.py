@@ -0,0 +1,31 @@
+"""
+    Wall clock time per named stage of a request, reported in logs and the Server-Timing header
+"""
+
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + (time.perf_counter() - start) * 1000
+
+    @property
+    def total(self):
+        return sum(self.stages.values())
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.stages.items())
+
+    def __str__(self):
+        stages = " ".join(f"{name}={duration:.1f}ms" for name, duration in self.stages.items())
+        return f"{stages} total={self.total:.1f}ms"
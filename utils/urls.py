@@ -0,0 +1,13 @@
+from django.urls import include, path
+
+from rest_framework_nested import routers
+
+from . import views
+from utils.default_string import U
+
+router = routers.DefaultRouter()
+router.register("export", views.ExportViewSet, basename=U.V1_EXPORT)
+
+urlpatterns = [
+    path("", include(router.urls))
+]
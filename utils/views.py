@@ -1,7 +1,25 @@
-from rest_framework import status
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.dateparse import parse_datetime
+from drf_yasg.utils import swagger_auto_schema
+
+from rest_framework import exceptions, status, viewsets
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from .default_string import S
+from . import cache as response_cache
+from . import idempotency
+from .default_string import S, T
+from .export import DATASETS, FORMATS, Export
+from .pagination import KeysetPagination
+from .streaming import StreamingJSONResponse
 
 
 class RetrieveMixin:
@@ -18,15 +36,140 @@ class RetrieveMixin:
 
 class PostMixin:
     """
-        Create a model instance
+        Create a model instance, retries with the same Idempotency-Key header get the first response
     """
 
     def custom_create(self, request, status_code=status.HTTP_200_OK, *args, **kwargs):
         kwargs.setdefault(S.CONTEXT, self.get_serializer_context())
-        serializer = self.get_serializer(data=request.data, context=kwargs[S.CONTEXT])
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status_code)
 
+        def create():
+            serializer = self.get_serializer(data=request.data, context=kwargs[S.CONTEXT])
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status_code)
+
+        return idempotency.run(request, create)
+
+
+def authenticate(request, permission_classes=(IsAuthenticated,)):
+    """
+        User of a plain Django view through the DRF authenticators and permissions of the API,
+        raises NotAuthenticated or PermissionDenied. Session users are CSRF checked by DRF, so the
+        view itself is csrf_exempt.
+    """
+    view = APIView()
+    view.permission_classes = permission_classes
+    view.format_kwarg = None
+    view.request = view.initialize_request(request)
+    view.check_permissions(view.request)
+    return view.request.user
+
+
+def conditional_get(method):
+    """
+        Answer 304 from the view validators before the wrapped action serializes anything.
+        The view returns (last modified, etag parts) from get_validators(), or None to skip.
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return method(self, request, *args, **kwargs)
+        last_modified, parts = validators
+        etag = quote_etag(hashlib.md5(repr((request.path, *parts)).encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = method(self, request, *args, **kwargs)
+        if response.status_code in [status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED]:
+            response["ETag"] = etag
+            if timestamp is not None:
+                response["Last-Modified"] = http_date(timestamp)
+        return response
+
+    return wrapper
+
+
+def cached_response(method):
+    """
+        Serve the action from the response cache, keyed by path, query and the generations of the
+        namespaces the view returns from get_cache_namespaces() (None skips the cache).
+        Off unless settings.RESPONSE_CACHE, which requires a cache shared by every process.
+    """
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        namespaces = self.get_cache_namespaces() if settings.RESPONSE_CACHE else None
+        if namespaces is None or request.method != "GET":
+            return method(self, request, *args, **kwargs)
+        key = response_cache.response_key(request, namespaces)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = method(self, request, *args, **kwargs)
+        if isinstance(response, Response) and response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, timeout=response_cache.get_timeout())
+        return response
+
+    return wrapper
+
+
+class StreamingListMixin:
+    """
+        List as a JSON array streamed from a server side cursor when ?stream=true.
+        Rows are serialized stream_chunk_size at a time, so memory does not grow with the row count.
+    """
+    stream_query_param = "stream"
+    stream_chunk_size = 500
+
+    def wants_stream(self):
+        return self.request.query_params.get(self.stream_query_param) in ["1", "true"]
+
+    def get_stream_ordering(self):
+        paginator = self.paginator
+        if isinstance(paginator, KeysetPagination):
+            return paginator.get_orderings(self)[paginator.get_ordering_name(self.request, self)]
+        return (S.ID,)
+
+    def stream_list(self, queryset, serializer_class=None):
+        return StreamingJSONResponse(
+            queryset.order_by(*self.get_stream_ordering()),
+            serializer_class or self.get_serializer_class(),
+            context=self.get_serializer_context(),
+            chunk_size=self.stream_chunk_size,
+        )
+
+    def list(self, request, *args, **kwargs):
+        if self.wants_stream():
+            return self.stream_list(self.filter_queryset(self.get_queryset()))
+        return super().list(request, *args, **kwargs)
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+        Staff only streaming export of catalog and order tables
+    """
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Export a dataset as CSV/JSONL",
+        tags=[T.EXPORT_TAG]
+    )
+    def retrieve(self, request, pk=None):
+        if pk not in DATASETS:
+            raise Http404
+        export_format = request.query_params.get("export_format", "csv")
+        if export_format not in FORMATS:
+            raise exceptions.ValidationError({"export_format": f"one of {', '.join(FORMATS)}"})
+        since = request.query_params.get("since")
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                raise exceptions.ValidationError({"since": "ISO datetime"})
+        compress = request.query_params.get("gzip") in ["1", "true"]
 
-# Create your views here.
+        export = Export(pk, format=export_format, since=since or None)
+        filename = f"{pk}.{export_format}" + (".gz" if compress else "")
+        content_type = "application/gzip" if compress else ("text/csv" if export_format == "csv" else "application/x-ndjson")
+        response = StreamingHttpResponse(export.chunks(compress=compress), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response